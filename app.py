@@ -2,28 +2,101 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import bisect
+import io
+import itertools
 import json
+import math
+import flask.json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+from flask import Flask, current_app, has_app_context, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context
+from flask.cli import with_appcontext
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
 import logging
+import click
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
+from pagination import paginate, InvalidCursor
+from search import SearchIndex, search_document
+from explain import check_routes
+from assets import Assets, build_assets
+from cache import Cache, LRUBackend, create_cache
+from compression import Compression
+from conditional import conditional, latest, make_etag
+from database import QueryFanOut, ReplicaRouter, RoutingSession, RoutingSQLAlchemy, configure_database, fetch_all, read_only
+from instrumentation import SQLInstrumentation
+from metrics import Metrics
+from importer import FORMATS as IMPORT_FORMATS, FormValidator, Resolver, chunked, detect_format, read_records, validate_records, write_rows
+from streaming import FORMATS as STREAM_FORMATS, row_encoder, stream_rows, stream_template
+from thumbnails import ImageFetchError, Thumbnails
 from flask_migrate import Migrate
-import sys
-from sqlalchemy import func
+import os
+import time
+from datetime import timedelta
+from urllib.parse import quote, urlencode
+from functools import lru_cache
+from sqlalchemy import and_, bindparam, case, event, exists, func, inspect, literal_column, or_, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.local import LocalProxy
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+class JSONEncoder(flask.json.JSONEncoder):
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super(JSONEncoder, self).default(o)
+
+
+moment = Moment()
+db = RoutingSQLAlchemy()
+migrate = Migrate()
+replica_router = ReplicaRouter(db)
+sql_instrumentation = SQLInstrumentation()
+metrics = Metrics()
+assets = Assets()
+compression = Compression()
+thumbnails = Thumbnails()
+# the detail cache of the current app, see create_app
+detail_cache = LocalProxy(lambda: current_app.extensions['detail_cache'])
+
+routes = []
+
+
+def route(rule, **options):
+    '''Register a view like app.route does, for every app create_app builds.'''
+    def decorator(view):
+        routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def instance_secret_key(app):
+    # generated once per instance folder so that every worker process on
+    # the host signs sessions and CSRF tokens with the same key
+    path = os.path.join(app.instance_path, 'secret_key')
+    if not os.path.exists(path):
+        os.makedirs(app.instance_path, exist_ok=True)
+        candidate = '%s.%d' % (path, os.getpid())
+        with open(candidate, 'w') as key_file:
+            key_file.write(os.urandom(32).hex())
+        try:
+            # link() fails if another worker got there first; use its key
+            os.link(candidate, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(candidate)
+    with open(path) as key_file:
+        return key_file.read().strip()
 
 
 #----------------------------------------------------------------------------#
@@ -32,22 +105,40 @@ migrate = Migrate(app, db)
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_venue_state_city_id', 'state', 'city', 'id'),
+        db.Index('ix_venue_state_city_name_id', 'state', 'city', 'name', 'id'),
+        db.Index('ix_venue_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
+    # listing sort keys: keyset cursors cannot step past a NULL
+    name = db.Column(db.String, nullable=False)
+    city = db.Column(db.String(120), nullable=False)
+    state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
-    genres = db.Column(db.ARRAY(db.String))
+    # active history, so an edit knows which genres it replaced
+    genres = db.column_property(
+        db.Column(db.ARRAY(db.String).with_variant(db.JSON, 'sqlite')), active_history=True)
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    search_document = db.Column(db.Text)
+    # maintained by the show counter hooks below
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped by every ORM update; keys the cached show tiles
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
 
     shows = db.relationship('Show', backref='Venue', lazy=True)
 
+    __mapper_args__ = {'version_id_col': version}
+
     def __init__(self, name, city, state, address, phone, image_link, genres, facebook_link, website, seeking_talent=False, seeking_description=""):
         self.name = name
         self.city = city
@@ -94,21 +185,38 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_artist_name_id', 'name', 'id'),
+        db.Index('ix_artist_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    # listing sort key: keyset cursors cannot step past a NULL
+    name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String))
+    # active history, so an edit knows which genres it replaced
+    genres = db.column_property(
+        db.Column(db.ARRAY(db.String).with_variant(db.JSON, 'sqlite')), active_history=True)
     image_link = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
     website = db.Column(db.String(120))
     facebook_link = db.Column(db.String(120))
+    search_document = db.Column(db.Text)
+    # maintained by the show counter hooks below
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped by every ORM update; keys the cached show tiles
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
 
     shows = db.relationship('Show', backref='Artist', lazy=True)
 
+    __mapper_args__ = {'version_id_col': version}
+
     def __init__(self, name, city, state, phone, genres, image_link, website, facebook_link, seeking_venue=False, seeking_description=""):
         self.name = name
         self.city = city
@@ -145,12 +253,19 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey(
         'Artist.id'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    # shows are never edited, so they need no updated_at
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
     def __init__(self, venue_id, artist_id, start_time):
         self.venue_id = venue_id
@@ -163,16 +278,16 @@ class Show(db.Model):
             'venue_name': self.Venue.name,
             'artist_id': self.artist_id,
             'artist_name': self.Artist.name,
-            'artiist_image_link': self.Artist.image_link,
-            'start_time': self.start_time.strftime('%Y-%m-%d %H:%M:%S')
+            'artist_image_link': self.Artist.image_link,
+            'start_time': self.start_time
         }
 
     def artisitDetail(self):
         return {
             'artist_id': self.artist_id,
             'artist_name': self.Artist.name,
-            'artiist_image_link': self.Artist.image_link,
-            'start_time': self.start_time.strftime('%Y-%m-%d %H:%M:%S')
+            'artist_image_link': self.Artist.image_link,
+            'start_time': self.start_time
         }
 
     def venueDetail(self):
@@ -180,31 +295,872 @@ class Show(db.Model):
             'venue_id': self.venue_id,
             'venue_name': self.Venue.name,
             'venue_image_link': self.Venue.image_link,
-            'start_time': self.start_time.strftime('%Y-%m-%d %H:%M:%S')
+            'start_time': self.start_time
         }
 
+
+@event.listens_for(Venue, 'before_insert')
+@event.listens_for(Venue, 'before_update')
+@event.listens_for(Artist, 'before_insert')
+@event.listens_for(Artist, 'before_update')
+def update_search_document(mapper, connection, target):
+    target.search_document = search_document(
+        target.name, target.city, target.state, target.genres)
+
+
+venue_search = SearchIndex(Venue, 'venue_search')
+artist_search = SearchIndex(Artist, 'artist_search')
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#
+# Venue and Artist carry upcoming/past show counts relative to a single
+# rollover time: a show counts as upcoming when it starts after it. Show
+# inserts and deletes adjust the counts in the same transaction, and the
+# rollover command periodically moves the shows that started since the
+# last rollover from upcoming to past. Both take the rollover row lock
+# first (shared for adjustments, exclusive for rollovers), so they never
+# classify a show against different rollover times.
+#----------------------------------------------------------------------------#
+
+class ShowCounterState(db.Model):
+    __tablename__ = 'ShowCounterState'
+
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime, nullable=False)
+
+
+@event.listens_for(ShowCounterState.__table__, 'after_create')
+def insert_show_counter_state(target, connection, **kw):
+    connection.execute(target.insert(), id=1, rolled_over_at=datetime.now())
+
+
+COUNTED_TABLES = ((Venue, Show.venue_id), (Artist, Show.artist_id))
+
+
+def show_counter_rollover_time(connection, exclusive=False):
+    state = ShowCounterState.__table__
+    query = select([state.c.rolled_over_at]).where(state.c.id == 1).with_for_update(
+        read=not exclusive)
+    return connection.execute(query).scalar()
+
+
+def update_show_counts(connection, model, deltas, touch=False):
+    # deltas maps an id to its (upcoming, past) adjustment
+    if not deltas:
+        return
+    table = model.__table__
+    # the counters alone leave updated_at, and with it the Last-Modified of
+    # the pages, as it is; a removed show leaves no created_at behind, so
+    # `touch` moves updated_at for the pages that listed it
+    connection.execute(
+        table.update().where(table.c.id == bindparam('counted_id')).values(
+            upcoming_shows_count=table.c.upcoming_shows_count + bindparam('upcoming'),
+            past_shows_count=table.c.past_shows_count + bindparam('past'),
+            updated_at=datetime.now() if touch else table.c.updated_at),
+        [{'counted_id': counted_id, 'upcoming': upcoming, 'past': past}
+         for counted_id, (upcoming, past) in sorted(deltas.items()) if upcoming or past])
+    if model is Venue:
+        refresh_venue_areas(connection, deltas)
+
+
+def adjust_show_counts(connection, shows, sign=1):
+    '''Count (venue_id, artist_id, start_time) `shows` as added, or removed with sign=-1.'''
+    rolled_over_at = show_counter_rollover_time(connection)
+    venues, artists = {}, {}
+    for venue_id, artist_id, start_time in shows:
+        if not isinstance(start_time, datetime):
+            start_time = dateutil.parser.parse(start_time)
+        upcoming = start_time > rolled_over_at
+        for deltas, counted_id in ((venues, int(venue_id)), (artists, int(artist_id))):
+            delta = deltas.get(counted_id, (0, 0))
+            deltas[counted_id] = (delta[0] + sign, delta[1]) if upcoming else (delta[0], delta[1] + sign)
+    update_show_counts(connection, Venue, venues, touch=sign < 0)
+    update_show_counts(connection, Artist, artists, touch=sign < 0)
+
+
+@event.listens_for(Show, 'after_insert')
+def count_inserted_show(mapper, connection, target):
+    adjust_show_counts(connection, [(target.venue_id, target.artist_id, target.start_time)])
+
+
+@event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, target):
+    adjust_show_counts(connection, [(target.venue_id, target.artist_id, target.start_time)], -1)
+
+
+def roll_over_show_counts(connection, now=None):
+    '''Move shows started since the last rollover to past; return how many.'''
+    now = now or datetime.now()
+    rolled_over_at = show_counter_rollover_time(connection, exclusive=True)
+    if now <= rolled_over_at:
+        return 0
+    moved = 0
+    for model, show_column in COUNTED_TABLES:
+        started = select([show_column, func.count(Show.id)]).where(
+            and_(Show.start_time > rolled_over_at, Show.start_time <= now)).group_by(show_column)
+        deltas = dict((counted_id, (-count, count)) for counted_id, count in connection.execute(started))
+        update_show_counts(connection, model, deltas)
+        if model is Venue:
+            moved = sum(past for _, past in deltas.values())
+    state = ShowCounterState.__table__
+    connection.execute(state.update().where(state.c.id == 1).values(rolled_over_at=now))
+    return moved
+
+
+def stale_show_counts(connection, fix=False):
+    '''Yield (model, id, stored counts, actual counts) for every wrong counter.
+
+    With `fix`, the stored counts are overwritten with the actual ones.
+    '''
+    rolled_over_at = show_counter_rollover_time(connection, exclusive=fix)
+    for model, show_column in COUNTED_TABLES:
+        table = model.__table__
+        counts = select([
+            show_column.label('counted_id'),
+            func.sum(case([(Show.start_time > rolled_over_at, 1)], else_=0)).label('upcoming'),
+            func.sum(case([(Show.start_time <= rolled_over_at, 1)], else_=0)).label('past')
+        ]).group_by(show_column).alias('counts')
+        rows = connection.execute(
+            select([table.c.id, table.c.upcoming_shows_count, table.c.past_shows_count,
+                    func.coalesce(counts.c.upcoming, 0), func.coalesce(counts.c.past, 0)])
+            .select_from(table.outerjoin(counts, counts.c.counted_id == table.c.id))
+            .where(or_(table.c.upcoming_shows_count != func.coalesce(counts.c.upcoming, 0),
+                       table.c.past_shows_count != func.coalesce(counts.c.past, 0)))
+            .order_by(table.c.id)).fetchall()
+        for counted_id, upcoming, past, actual_upcoming, actual_past in rows:
+            if fix:
+                connection.execute(table.update().where(table.c.id == counted_id).values(
+                    upcoming_shows_count=actual_upcoming, past_shows_count=actual_past,
+                    updated_at=table.c.updated_at))
+                if model is Venue:
+                    refresh_venue_areas(connection, [counted_id])
+            yield model, counted_id, (upcoming, past), (actual_upcoming, actual_past)
+
+#----------------------------------------------------------------------------#
+# Area directory.
+#
+# One row per (state, city) with its venue count, total upcoming shows and
+# its busiest venues, so the /venues directory reads a small table in key
+# order instead of every venue. Rows are recomputed for just the areas a
+# venue insert, update, delete or show count change touches. A recompute
+# overwrites the row with what its transaction reads, so transactions
+# recomputing the same area take turns: each reads the venues the one
+# before it committed.
+#----------------------------------------------------------------------------#
+
+class Area(db.Model):
+    __tablename__ = 'Area'
+
+    state = db.Column(db.String(120), primary_key=True)
+    city = db.Column(db.String(120), primary_key=True)
+    venue_count = db.Column(db.Integer, nullable=False)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False)
+    # [{'id', 'name', 'num_upcoming_shows'}] by upcoming shows, busiest first
+    top_venues = db.Column(db.JSON, nullable=False)
+
+
+def upsert_area(connection, values):
+    table = Area.__table__
+    if connection.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(values)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.state, table.c.city],
+            set_=dict((key, statement.excluded[key]) for key in values if key not in ('state', 'city'))))
+    elif connection.dialect.name == 'sqlite':
+        connection.execute(table.insert().prefix_with('OR REPLACE').values(values))
+    else:
+        key = and_(table.c.state == values['state'], table.c.city == values['city'])
+        if not connection.execute(table.update().where(key).values(values)).rowcount:
+            connection.execute(table.insert().values(values))
+
+
+def lock_area(connection, state, city):
+    # held until the transaction ends; SQLite already runs one writer at a time
+    if connection.dialect.name == 'postgresql':
+        connection.execute(select([func.pg_advisory_xact_lock(func.hashtext(state), func.hashtext(city))]))
+
+
+def refresh_areas(connection, areas):
+    '''Recompute the directory rows of the (city, state) `areas`.'''
+    venue, table = Venue.__table__, Area.__table__
+    top_venues = current_app.config['AREA_TOP_VENUES']
+    # sorted, so transactions refreshing several areas lock them in the same order
+    for city, state in sorted(set(tuple(area) for area in areas if None not in tuple(area))):
+        lock_area(connection, state, city)
+        in_area = and_(venue.c.state == state, venue.c.city == city)
+        venue_count, upcoming_shows_count = connection.execute(
+            select([func.count(venue.c.id), func.coalesce(func.sum(venue.c.upcoming_shows_count), 0)])
+            .where(in_area)).first()
+        if not venue_count:
+            connection.execute(table.delete().where(and_(table.c.state == state, table.c.city == city)))
+            continue
+        busiest = connection.execute(
+            select([venue.c.id, venue.c.name, venue.c.upcoming_shows_count]).where(in_area)
+            .order_by(venue.c.upcoming_shows_count.desc(), venue.c.id).limit(top_venues))
+        upsert_area(connection, {
+            'state': state,
+            'city': city,
+            'venue_count': venue_count,
+            'upcoming_shows_count': upcoming_shows_count,
+            'top_venues': [{'id': row.id, 'name': row.name, 'num_upcoming_shows': row.upcoming_shows_count}
+                           for row in busiest]
+        })
+
+
+def refresh_venue_areas(connection, venue_ids):
+    venue = Venue.__table__
+    venue_ids = list(venue_ids)
+    if venue_ids:
+        refresh_areas(connection, connection.execute(
+            select([venue.c.city, venue.c.state]).where(venue.c.id.in_(venue_ids)).distinct()))
+
+
+def rebuild_areas(connection):
+    '''Recompute the whole directory; return the number of areas.'''
+    venue = Venue.__table__
+    areas = connection.execute(select([venue.c.city, venue.c.state]).distinct()).fetchall()
+    connection.execute(Area.__table__.delete())
+    refresh_areas(connection, areas)
+    return len(areas)
+
+
+@event.listens_for(Venue, 'after_insert')
+@event.listens_for(Venue, 'after_delete')
+def refresh_venue_area(mapper, connection, target):
+    refresh_areas(connection, [(target.city, target.state)])
+
+
+@event.listens_for(Venue, 'after_update')
+def refresh_moved_venue_areas(mapper, connection, target):
+    # a venue that moved leaves its old area as well as joining a new one
+    state = inspect(target)
+    areas = [(target.city, target.state)]
+    old_city = state.attrs.city.history.deleted
+    old_state = state.attrs.state.history.deleted
+    if old_city or old_state:
+        areas.append((old_city[0] if old_city else target.city, old_state[0] if old_state else target.state))
+    refresh_areas(connection, areas)
+
+#----------------------------------------------------------------------------#
+# Genre facets.
+#
+# Listings and searches filter on genres with `genres @> ARRAY[genre]`,
+# answered by the GIN indexes on Venue.genres and Artist.genres. The
+# number of venues and artists in each genre is kept in GenreCount and
+# adjusted by the genres an insert, edit or delete adds or removes, so the
+# facets read one small table instead of counting every row.
+#----------------------------------------------------------------------------#
+
+class GenreCount(db.Model):
+    __tablename__ = 'GenreCount'
+
+    genre = db.Column(db.String(120), primary_key=True)
+    venue_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    artist_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+GENRE_COUNT_COLUMNS = {Venue: 'venue_count', Artist: 'artist_count'}
+
+
+def has_genre(model, genre, dialect):
+    if dialect == 'postgresql':
+        # genres @> ARRAY[genre], which a GIN index on genres can answer
+        return model.genres.op('@>')(db.cast(postgresql.array([genre]), postgresql.ARRAY(db.String)))
+    # genres is a JSON array on SQLite
+    return exists(select([literal_column('1')]).select_from(func.json_each(model.genres)).where(
+        literal_column('value') == genre))
+
+
+def genre_deltas(added=(), removed=()):
+    '''Return {genre: change in count} for rows gaining the `added` and losing the `removed` genre lists.'''
+    deltas = {}
+    for genres, sign in [(genres, 1) for genres in added] + [(genres, -1) for genres in removed]:
+        # a genre listed twice still counts the row once
+        for genre in set(genres or ()):
+            deltas[genre] = deltas.get(genre, 0) + sign
+    return deltas
+
+
+def adjust_genre_counts(connection, model, deltas):
+    table = GenreCount.__table__
+    column = GENRE_COUNT_COLUMNS[model]
+    # sorted, so concurrent adjustments lock the rows in the same order
+    rows = [{'genre': genre, column: delta} for genre, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        statement = postgresql.insert(table)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.genre],
+            set_={column: table.c[column] + statement.excluded[column]}), rows)
+        return
+    for row in rows:
+        if not connection.execute(table.update().where(table.c.genre == row['genre']).values(
+                {column: table.c[column] + row[column]})).rowcount:
+            connection.execute(table.insert().values(row))
+
+
+def rebuild_genre_counts(connection):
+    '''Recount every genre from the Venue and Artist tables; return the number of genres.'''
+    connection.execute(GenreCount.__table__.delete())
+    genres = set()
+    for model in GENRE_COUNT_COLUMNS:
+        deltas = genre_deltas(row.genres for row in connection.execute(select([model.__table__.c.genres])))
+        adjust_genre_counts(connection, model, deltas)
+        genres.update(deltas)
+    return len(genres)
+
+
+@event.listens_for(Venue, 'after_insert')
+@event.listens_for(Artist, 'after_insert')
+def count_inserted_genres(mapper, connection, target):
+    adjust_genre_counts(connection, mapper.class_, genre_deltas(added=[target.genres]))
+
+
+@event.listens_for(Venue, 'after_delete')
+@event.listens_for(Artist, 'after_delete')
+def count_deleted_genres(mapper, connection, target):
+    adjust_genre_counts(connection, mapper.class_, genre_deltas(removed=[target.genres]))
+
+
+@event.listens_for(Venue, 'after_update')
+@event.listens_for(Artist, 'after_update')
+def count_edited_genres(mapper, connection, target):
+    history = inspect(target).attrs.genres.history
+    if history.added or history.deleted:
+        adjust_genre_counts(connection, mapper.class_, genre_deltas(history.added, history.deleted))
+
+
+def genre_facets(model):
+    '''Return [(genre, count of `model` rows)] for every genre choice.'''
+    column = GenreCount.__table__.c[GENRE_COUNT_COLUMNS[model]]
+    counts = dict(db.session.execute(select([GenreCount.genre, column])).fetchall())
+    return [(genre, counts.get(genre, 0)) for genre, _ in genres_choices]
+
+
+def genre_filter(query, model, genre):
+    if not genre:
+        return query
+    return query.filter(has_genre(model, genre, db.session.get_bind().dialect.name))
+
+#----------------------------------------------------------------------------#
+# Image thumbnails.
+#
+# A venue or artist whose image_link is new or changed has the image
+# fetched and thumbnailed in the background once the change commits; pages
+# link the original image until its thumbnails exist.
+#----------------------------------------------------------------------------#
+
+@event.listens_for(Venue, 'after_insert')
+@event.listens_for(Venue, 'after_update')
+@event.listens_for(Artist, 'after_insert')
+@event.listens_for(Artist, 'after_update')
+def queue_thumbnails(mapper, connection, target):
+    state = inspect(target)
+    if target.image_link and state.attrs.image_link.history.added:
+        state.session.info.setdefault('thumbnail_links', set()).add(target.image_link)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def fetch_thumbnails(session):
+    links = session.info.pop('thumbnail_links', ())
+    if links and has_app_context():
+        for link in sorted(links):
+            current_app.extensions['thumbnails'].submit(link)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_thumbnails(session):
+    session.info.pop('thumbnail_links', None)
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma"
+}
+
+
+@lru_cache(maxsize=64)
+def datetime_pattern(format, locale):
+    # parsing the CLDR pattern and loading the locale dominate babel's cost
+    pattern = babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+    return pattern, babel.Locale.parse(locale)
+
+
+@lru_cache(maxsize=4096)
+def format_native_datetime(value, format, locale):
+    pattern, locale = datetime_pattern(format, locale)
+    return pattern.apply(value, locale)
+
+
+def format_datetime(value, format='medium', locale=babel.dates.LC_TIME):
+    if not isinstance(value, datetime):
+        value = dateutil.parser.parse(value)
+    return format_native_datetime(value, format, locale)
+
+
+def cached_fragment(*key, caller):
+    '''Render a `{% call cached_fragment(*key) %}` block once per key.
+
+    The key must change whenever anything the block renders does, e.g. by
+    including the versions of the records it shows.
+    '''
+    key = ':'.join(str(part) for part in key)
+    return current_app.extensions['fragment_cache'].get_or_build(key, lambda: (caller(), None))
+
+
+#----------------------------------------------------------------------------#
+# Listing queries.
+#----------------------------------------------------------------------------#
+
+area_listing_order = (Area.state, Area.city)
+venue_listing_order = (Venue.state, Venue.city, Venue.id)
+area_venue_listing_order = (Venue.name, Venue.id)
+artist_listing_order = (Artist.name, Artist.id)
+show_listing_order = (Show.start_time, Show.id)
+
+
+def venue_listing_query():
+    # upcoming show counts come from the maintained counter column
+    return db.session.query(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        Venue.upcoming_shows_count.label('num_upcoming_shows')
+    )
+
+
+def area_listing_query():
+    return db.session.query(
+        Area.state,
+        Area.city,
+        Area.venue_count,
+        Area.upcoming_shows_count,
+        Area.top_venues
+    )
+
+
+def area_listing_detail(area):
+    return {
+        'city': area.city,
+        'state': area.state,
+        'venue_count': area.venue_count,
+        'upcoming_shows_count': area.upcoming_shows_count,
+        'venues': area.top_venues
+    }
+
+
+def genre_area_listing(venues):
+    # venues in (state, city) order, grouped like the directory's areas
+    areas = []
+    for (state, city), group in itertools.groupby(venues, lambda venue: (venue['state'], venue['city'])):
+        group = list(group)
+        areas.append({
+            'city': city,
+            'state': state,
+            'venue_count': len(group),
+            'upcoming_shows_count': sum(venue['num_upcoming_shows'] for venue in group),
+            'venues': group
+        })
+    return areas
 
 
-app.jinja_env.filters['datetime'] = format_datetime
+def artist_listing_query():
+    return db.session.query(Artist.id, Artist.name)
+
+
+def show_listing_query():
+    # only the columns rendered by shows.html, fetched in one joined query
+    return db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link')
+    ).join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id)
+
+
+def venue_listing_detail(venue):
+    return {
+        'id': venue.id,
+        'name': venue.name,
+        'city': venue.city,
+        'state': venue.state,
+        'num_upcoming_shows': venue.num_upcoming_shows
+    }
+
+
+def artist_listing_detail(artist):
+    return {
+        'id': artist.id,
+        'name': artist.name
+    }
+
+
+def show_listing_detail(show):
+    return {
+        'venue_id': show.venue_id,
+        'venue_name': show.venue_name,
+        'artist_id': show.artist_id,
+        'artist_name': show.artist_name,
+        'artist_image_link': show.artist_image_link,
+        'start_time': show.start_time
+    }
+
+
+def show_tile_detail(show):
+    # a show itself never changes, but its tile shows its artist and venue
+    return dict(show_listing_detail(show), id=show.id, version='%d.%d' % (show.artist_version, show.venue_version))
+
+
+def paginate_request(query, order_by, per_page):
+    try:
+        return paginate(query, order_by, request.args.get('cursor'), per_page)
+    except InvalidCursor:
+        abort(400)
+
+
+#----------------------------------------------------------------------------#
+# Detail payloads.
+#----------------------------------------------------------------------------#
+
+def rollover_timeout(upcoming_shows_result):
+    # a cached past/upcoming split is only valid until the next show starts
+    if not upcoming_shows_result:
+        return None
+    next_start_time = min(show.start_time for show in upcoming_shows_result)
+    return (next_start_time - datetime.now()).total_seconds()
+
+
+def build_venue_detail(venue_id):
+    current_time = datetime.now()
+    shows_query = Show.query.join(Artist).options(contains_eager(Show.Artist)).filter(
+        Show.venue_id == venue_id)
+    venue_result, past_shows_result, upcoming_shows_result = fetch_all(
+        Venue.query.filter(Venue.id == venue_id),
+        shows_query.filter(Show.start_time <= current_time),
+        shows_query.filter(Show.start_time > current_time))
+    if not venue_result:
+        return None, None
+    venue_detail = Venue.allDetail(venue_result[0])
+    # past shows
+    past_shows = list(map(Show.artisitDetail, past_shows_result))
+    venue_detail["past_shows"] = past_shows
+    venue_detail["past_shows_count"] = len(past_shows)
+    # upcoming shows
+    upcoming_shows = list(map(Show.artisitDetail, upcoming_shows_result))
+    venue_detail["upcoming_shows"] = upcoming_shows
+    venue_detail["upcoming_shows_count"] = len(upcoming_shows)
+    return venue_detail, rollover_timeout(upcoming_shows_result)
+
+
+def build_artist_detail(artist_id):
+    current_time = datetime.now()
+    shows_query = Show.query.join(Venue).options(contains_eager(Show.Venue)).filter(
+        Show.artist_id == artist_id)
+    artist_result, past_shows_result, upcoming_shows_result = fetch_all(
+        Artist.query.filter(Artist.id == artist_id),
+        shows_query.filter(Show.start_time <= current_time),
+        shows_query.filter(Show.start_time > current_time))
+    if not artist_result:
+        return None, None
+    artist_detail = Artist.allDetail(artist_result[0])
+    # past shows
+    past_shows = list(map(Show.venueDetail, past_shows_result))
+    artist_detail["past_shows"] = past_shows
+    artist_detail["past_shows_count"] = len(past_shows)
+    # upcoming shows
+    upcoming_shows = list(map(Show.venueDetail, upcoming_shows_result))
+    artist_detail["upcoming_shows"] = upcoming_shows
+    artist_detail["upcoming_shows_count"] = len(upcoming_shows)
+    return artist_detail, rollover_timeout(upcoming_shows_result)
+
+
+def venue_detail_key(venue_id):
+    return 'venue:%d' % int(venue_id)
+
+
+def artist_detail_key(artist_id):
+    return 'artist:%d' % int(artist_id)
+
+
+def related_detail_keys(venue_id=None, artist_id=None):
+    # venue pages list their artists and artist pages their venues
+    keys = []
+    if venue_id is not None:
+        keys.append(venue_detail_key(venue_id))
+        artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+        keys.extend(artist_detail_key(related_id) for related_id, in artist_ids)
+    if artist_id is not None:
+        keys.append(artist_detail_key(artist_id))
+        venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()
+        keys.extend(venue_detail_key(related_id) for related_id, in venue_ids)
+    return keys
+
+
+#----------------------------------------------------------------------------#
+# Page validators.
+#----------------------------------------------------------------------------#
+
+def thumbnails_time(images):
+    # the newest thumbnail link of `images`, as a validator time
+    times = [state for state in images.values() if state is not None]
+    return datetime.fromtimestamp(max(times) / 1e9) if times else None
+
+
+def detail_validators(model, foreign_key, related, related_key, entity_id):
+    '''Return the (etag, last_modified) of a venue or artist page.
+
+    The page changes when the record, one of its shows or the record on
+    the other side of a show changes, whenever one of its shows starts,
+    and when the thumbnails of the images it shows appear or go. Returns
+    (None, None) if there is no such record.
+    '''
+    now = datetime.now()
+    started = Show.start_time <= now
+    row = db.session.query(
+        model.image_link,
+        model.version,
+        model.updated_at,
+        func.count(Show.id),
+        func.count(case([(started, Show.id)])),
+        func.max(Show.created_at),
+        func.max(case([(started, Show.start_time)])),
+        func.max(related.updated_at)
+    ).outerjoin(Show, foreign_key == model.id).outerjoin(related, related_key == related.id).filter(
+        model.id == entity_id).group_by(model.id).first()
+    if row is None:
+        return None, None
+    image_link, version, updated_at, shows_count, started_count, last_created_at, last_started_at, related_updated_at = row
+    related_images = db.session.query(related.image_link).join(Show, related_key == related.id).filter(
+        foreign_key == entity_id).distinct()
+    images = thumbnails.states([image_link] + [link for link, in related_images])
+    etag = make_etag(model.__tablename__, entity_id, sorted(images.items()), *row)
+    return etag, latest(updated_at, last_created_at, last_started_at, related_updated_at, thumbnails_time(images))
+
+
+#----------------------------------------------------------------------------#
+# Show scheduling.
+#
+# A show books its venue and its artist from its start time for
+# SHOW_LENGTH_MINUTES. New shows are checked against existing bookings
+# with range queries on the (venue_id, start_time) and (artist_id,
+# start_time) indexes, and against the shows listed before them in the
+# same batch. Shows that conflict are reported and the rest are inserted
+# in one transaction. The venue and artist rows are locked first, so
+# batches booking the same venue or artist run one after the other.
+#----------------------------------------------------------------------------#
+
+# bookings checked per range query
+BOOKING_QUERY_CHUNK = 500
+
+
+def lock_bookable(connection, model, ids):
+    # in id order, like the counter updates, so that batches cannot deadlock
+    table = model.__table__
+    query = select([table.c.id]).where(table.c.id.in_(sorted(ids))).order_by(table.c.id).with_for_update()
+    return set(row[0] for row in connection.execute(query))
+
+
+def booked_times(connection, column, bookings, length):
+    '''Map venue or artist ids to the sorted start times of their shows overlapping `bookings`.'''
+    booked = {}
+    for chunk in chunked(sorted(set(bookings)), BOOKING_QUERY_CHUNK):
+        overlapping = or_(*[
+            and_(column == booked_id, Show.start_time > start_time - length,
+                 Show.start_time < start_time + length)
+            for booked_id, start_time in chunk])
+        for booked_id, start_time in connection.execute(select([column, Show.start_time]).where(overlapping)):
+            booked.setdefault(booked_id, set()).add(start_time)
+    return dict((booked_id, sorted(times)) for booked_id, times in booked.items())
+
+
+def clashing_show(times, start_time, length):
+    '''Return a start time in the sorted `times` less than `length` from `start_time`, or None.'''
+    position = bisect.bisect_left(times, start_time)
+    for other in times[max(position - 1, 0):position + 1]:
+        if abs(other - start_time) < length:
+            return other
+    return None
+
+
+def schedule_shows(connection, shows):
+    '''Insert the (venue_id, artist_id, start_time) `shows` that fit the schedule.
+
+    Returns (scheduled, conflicts): the positions in `shows` of the inserted
+    shows, and {position: errors} for the others.
+    '''
+    if not shows:
+        return [], {}
+    length = timedelta(minutes=current_app.config['SHOW_LENGTH_MINUTES'])
+    # the counter updates below take the rollover lock; take it before the
+    # venue and artist locks, in the order every show insert does
+    show_counter_rollover_time(connection)
+    sides = (('venue_id', 'Venue', Venue, Show.venue_id), ('artist_id', 'Artist', Artist, Show.artist_id))
+    conflicts, booked = {}, []
+    for side, (field, noun, model, column) in enumerate(sides):
+        existing = lock_bookable(connection, model, set(show[side] for show in shows))
+        for position, show in enumerate(shows):
+            if show[side] not in existing:
+                conflicts.setdefault(position, {})[field] = ['%s %d does not exist' % (noun, show[side])]
+        booked.append(booked_times(
+            connection, column, [(show[side], show[2]) for show in shows if show[side] in existing], length))
+    scheduled = []
+    for position, show in enumerate(shows):
+        if position in conflicts:
+            continue
+        errors = {}
+        for side, (field, noun, _, _) in enumerate(sides):
+            other = clashing_show(booked[side].get(show[side], []), show[2], length)
+            if other is not None:
+                errors[field] = ['%s %d is booked for a show starting %s' % (
+                    noun, show[side], other.strftime('%Y-%m-%d %H:%M'))]
+        if errors:
+            conflicts[position] = errors
+            continue
+        # later shows in the batch must not clash with this one either
+        for side in range(len(sides)):
+            bisect.insort(booked[side].setdefault(show[side], []), show[2])
+        scheduled.append(position)
+    rows = [(shows[position][1], shows[position][0], shows[position][2]) for position in scheduled]
+    write_rows(connection, Show.__table__, ('artist_id', 'venue_id', 'start_time'), rows)
+    adjust_show_counts(connection, [shows[position] for position in scheduled])
+    return scheduled, conflicts
+
+
+def schedule_records(records):
+    '''Validate, schedule and commit the shows of (line number, record) pairs.
+
+    Records take the columns of `flask import shows`. Returns (scheduled,
+    rejected): the line numbers of the listed shows and {line number:
+    errors} for the others.
+    '''
+    validator = FormValidator(ShowForm)
+    rejected, accepted = {}, []
+    for line_number, record in records:
+        data, errors = validator.validate(record)
+        if errors:
+            rejected[line_number] = errors
+        else:
+            accepted.append((line_number, record, data))
+    venues, artists = Resolver(db.session, Venue), Resolver(db.session, Artist)
+    venues.prefetch([r.get('venue_id') for _, r, _ in accepted if r.get('venue_id')],
+                    [r.get('venue_name') for _, r, _ in accepted if not r.get('venue_id')])
+    artists.prefetch([r.get('artist_id') for _, r, _ in accepted if r.get('artist_id')],
+                     [r.get('artist_name') for _, r, _ in accepted if not r.get('artist_id')])
+    line_numbers, shows = [], []
+    for line_number, record, data in accepted:
+        venue_id = venues.resolve(record.get('venue_id'), record.get('venue_name'))
+        artist_id = artists.resolve(record.get('artist_id'), record.get('artist_name'))
+        if venue_id is None or artist_id is None:
+            rejected[line_number] = {'venue_id' if venue_id is None else 'artist_id': ['Unknown reference']}
+            continue
+        line_numbers.append(line_number)
+        shows.append((venue_id, artist_id, data['start_time']))
+    scheduled, conflicts = schedule_shows(db.session.connection(), shows)
+    db.session.commit()
+    detail_cache.delete(*set(
+        [venue_detail_key(shows[position][0]) for position in scheduled] +
+        [artist_detail_key(shows[position][1]) for position in scheduled]))
+    for position, errors in conflicts.items():
+        rejected[line_numbers[position]] = errors
+    return [line_numbers[position] for position in scheduled], rejected
+
+
+#----------------------------------------------------------------------------#
+# Venue availability.
+#
+# A venue is free on a day when none of its shows overlaps that day's time
+# slot. The shows of the matching venues that fall in the searched window
+# are read with one range query on (venue_id, start_time) and folded into
+# a bitmap of busy days per venue; its clear bits are the free days.
+#----------------------------------------------------------------------------#
+
+DAY_SECONDS = 24 * 3600
+
+
+def busy_days(offset, days, slot_length, show_length):
+    '''Return the bitmap of the days whose slot a show starting `offset` seconds after the first slot overlaps.'''
+    # the show overlaps the slot of day k when
+    # offset - slot_length < k days < offset + show_length
+    first = max(math.floor((offset - slot_length) / DAY_SECONDS) + 1, 0)
+    last = min(math.ceil((offset + show_length) / DAY_SECONDS) - 1, days - 1)
+    if last < first:
+        return 0
+    return ((1 << (last - first + 1)) - 1) << first
+
+
+def venue_availability(state, city, genre, first_day, last_day, starts_at, ends_at, limit):
+    '''Find the matching venues free on at least one day, most free first.
+
+    Returns (count, [(venue, free days)]) with the first `limit` venues.
+    '''
+    days = (last_day - first_day).days + 1
+    first_slot = datetime.combine(first_day, starts_at)
+    slot_length = (datetime.combine(first_day, ends_at) - first_slot).total_seconds()
+    if slot_length <= 0:
+        slot_length += DAY_SECONDS
+    show_length = current_app.config['SHOW_LENGTH_MINUTES'] * 60
+    # cities are typed in, so match them in any case; the state prefix of
+    # ix_venue_state_city_id still narrows the scan
+    matching = and_(Venue.state == state, func.lower(Venue.city) == func.lower(city))
+    if genre:
+        matching = and_(matching, has_genre(Venue, genre, db.session.get_bind().dialect.name))
+    venues = db.session.execute(
+        select([Venue.id, Venue.name]).where(matching).order_by(Venue.name, Venue.id)).fetchall()
+    shows = db.session.execute(select([Show.venue_id, Show.start_time]).select_from(
+        Show.__table__.join(Venue.__table__, Venue.id == Show.venue_id)).where(and_(
+            matching,
+            Show.start_time > first_slot - timedelta(seconds=show_length),
+            Show.start_time < first_slot + timedelta(days=days - 1, seconds=slot_length)))).fetchall()
+    busy = {}
+    for venue_id, start_time in shows:
+        busy[venue_id] = busy.get(venue_id, 0) | busy_days(
+            (start_time - first_slot).total_seconds(), days, slot_length, show_length)
+    every_day = (1 << days) - 1
+    available = []
+    for venue in venues:
+        free = every_day & ~busy.get(venue.id, 0)
+        if free:
+            available.append((bin(free).count('1'), venue, free))
+    # stable, so venues free as often stay in name order
+    available.sort(key=lambda item: -item[0])
+    # only the listed venues need their bitmap spelled out
+    calendar = [first_day + timedelta(days=day) for day in range(days)]
+    return len(available), [(venue, [calendar[day] for day in range(days) if free >> day & 1])
+                            for _, venue, free in available[:limit]]
+
+
+def availability_request():
+    '''Validate the availability search in the query string; return (form, (count, venues) or None).'''
+    form = AvailabilityForm(request.args, meta={'csrf': False})
+    if not request.args or not form.validate():
+        return form, None
+    first_day = form.first_day.data
+    last_day = form.last_day.data or first_day
+    if (last_day - first_day).days >= current_app.config['AVAILABILITY_MAX_DAYS']:
+        form.last_day.errors.append('Search at most %d days.' % current_app.config['AVAILABILITY_MAX_DAYS'])
+        return form, None
+    return form, venue_availability(
+        form.state.data, form.city.data.strip(), form.genre.data, first_day, last_day,
+        form.starts_at.data, form.ends_at.data or datetime.min.time(),
+        current_app.config['AVAILABILITY_RESULTS_LIMIT'])
+
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 
-@app.route('/')
+@route('/')
 def index():
     return render_template('pages/home.html')
 
@@ -212,80 +1168,85 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@route('/venues')
+@read_only
 def venues():
-    data = []
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    all_areas = Venue.query.with_entities(func.count(Venue.id), Venue.city, Venue.state).group_by(Venue.city, Venue.state).all()
-
-    for area in all_areas:
-        venues_results = Venue.query.filter_by(state=area.state).filter_by(city=area.city).all()
-        venues_data = []
-
-        for venue in venues_results:
-            upcoming_shows = Show.query.filter(Show.venue_id == 1).filter(Show.start_time > current_time).all()
-            upcoming_shows_count = len(upcoming_shows)
-            venues_data.append({
-                "id": venue.id,
-                "name": venue.name,
-                "num_upcoming_shows": upcoming_shows_count
-            })
-        data.append({
-            "city": area.city,
-            "state": area.state,
-            "venues": venues_data
-        })
-    return render_template('pages/venues.html', areas=data)
+    genre = request.args.get('genre')
+    facets = genre_facets(Venue)
+    if genre:
+        # the directory has no per-genre rows, so list the genre's venues by area
+        query = genre_filter(venue_listing_query(), Venue, genre)
+        page = paginate_request(query, venue_listing_order, current_app.config['VENUES_PER_PAGE'])
+        data = genre_area_listing(map(venue_listing_detail, page.items))
+    else:
+        page = paginate_request(area_listing_query(), area_listing_order, current_app.config['AREAS_PER_PAGE'])
+        data = list(map(area_listing_detail, page.items))
+    return stream_template('pages/venues.html', areas=data, page=page, facets=facets, genre=genre)
 
 
-@app.route('/venues/search', methods=['POST'])
+@route('/venues/areas/<state>/<city>')
+@read_only
+def venue_area(state, city):
+    area = Area.query.get((state, city))
+    if area is None:
+        abort(404)
+    query = venue_listing_query().filter(Venue.state == state, Venue.city == city)
+    page = paginate_request(query, area_venue_listing_order, current_app.config['VENUES_PER_PAGE'])
+    return render_template('pages/venue_area.html', area=area_listing_detail(area),
+                           venues=list(map(venue_listing_detail, page.items)), page=page)
+
+
+@route('/venues/search', methods=['POST'])
+@read_only
 def search_venues():
-    venue_result = Venue.query.filter(Venue.name.ilike(
-        '%' + request.form['search_term'] + '%')).all()
-    venues = []
-    for venue in venue_result:
-        venues = list(map(Venue.shortDetail, venue_result))
+    genre = request.form.get('genre')
+    venue_result = venue_search.search(
+        genre_filter(Venue.query, Venue, genre), request.form['search_term'],
+        current_app.config['SEARCH_RESULTS_LIMIT']).all()
+    venues = list(map(Venue.shortDetail, venue_result))
     response = {
         "count": len(venues),
         "data": venues
     }
-    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''),
+                           facets=genre_facets(Venue), genre=genre)
+
 
+@route('/venues/availability')
+@read_only
+def venue_availability_search():
+    form, results = availability_request()
+    return render_template('pages/venue_availability.html', form=form, results=results)
 
-@app.route('/venues/<int:venue_id>')
+
+@route('/venues/<int:venue_id>')
+@read_only
 def show_venue(venue_id):
-    venue = Venue.query.get(venue_id)
-    if venue:
-        venue_detail = Venue.allDetail(venue)
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        # past shows
-        past_shows_result = Show.query.join(Artist).filter(
-            Show.venue_id == venue_id).filter(Show.start_time <= current_time)
-        past_shows = list(map(Show.artisitDetail, past_shows_result))
-        venue_detail["past_shows"] = past_shows
-        venue_detail["past_shows_count"] = len(past_shows)
-        # upcoming shows
-        upcoming_shows_result = Show.query.join(Artist).filter(
-            Show.venue_id == venue_id).filter(Show.start_time > current_time)
-        upcoming_shows = list(map(Show.artisitDetail, upcoming_shows_result))
-        venue_detail["upcoming_shows"] = upcoming_shows
-        venue_detail["upcoming_shows_count"] = len(upcoming_shows)
-
-        return render_template('pages/show_venue.html', venue=venue_detail)
-    else:
+    etag, last_modified = detail_validators(Venue, Show.venue_id, Artist, Show.artist_id, venue_id)
+    if etag is None:
         return render_template('errors/404.html')
 
+    def render():
+        # versioned by the ETag, so a cached body always matches its validators
+        venue_detail = detail_cache.get_or_build(
+            venue_detail_key(venue_id), lambda: build_venue_detail(venue_id), etag)
+        if venue_detail:
+            return render_template('pages/show_venue.html', venue=venue_detail)
+        else:
+            return render_template('errors/404.html')
+    return conditional(etag, last_modified, render)
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
 
-@app.route('/venues/create', methods=['GET'])
+@route('/venues/create', methods=['GET'])
 def create_venue_form():
     form = VenueForm()
     return render_template('forms/new_venue.html', form=form)
 
 
-@app.route('/venues/create', methods=['POST'])
+@route('/venues/create', methods=['POST'])
 def create_venue_submission():
     error = False
     try:
@@ -307,7 +1268,7 @@ def create_venue_submission():
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        current_app.logger.exception('%s failed', request.endpoint)
     finally:
         db.session.close()
     if error:
@@ -318,15 +1279,17 @@ def create_venue_submission():
     return render_template('pages/home.html')
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
     try:
         venue = Venue.query.get(venue_id)
+        stale_keys = related_detail_keys(venue_id=venue.id)
         db.session.delete(venue)
         db.session.commit()
+        detail_cache.delete(*stale_keys)
     except:
         db.session.rollback()
-        print(sys.exc_info())
+        current_app.logger.exception('%s failed', request.endpoint)
     finally:
         db.session.close()
 
@@ -334,51 +1297,60 @@ def delete_venue(venue_id):
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@route('/artists')
+@read_only
 def artists():
-    artists_result = Artist.query.all()
-    data = list(map(Artist.shortDetail, artists_result))
-    return render_template('pages/artists.html', artists=data)
+    genre = request.args.get('genre')
+    page = paginate_request(genre_filter(artist_listing_query(), Artist, genre), artist_listing_order,
+                            current_app.config['ARTISTS_PER_PAGE'])
+    data = list(map(artist_listing_detail, page.items))
+    return render_template('pages/artists.html', artists=data, page=page, facets=genre_facets(Artist), genre=genre)
 
 
-@app.route('/artists/search', methods=['POST'])
+@route('/artists/search', methods=['POST'])
+@read_only
 def search_artists():
-    artists_result = Artist.query.filter(Artist.name.ilike(
-        '%' + request.form['search_term'] + '%')).all()
+    genre = request.form.get('genre')
+    artists_result = artist_search.search(
+        genre_filter(Artist.query, Artist, genre), request.form['search_term'],
+        current_app.config['SEARCH_RESULTS_LIMIT']).all()
     data = list(map(Artist.shortDetail, artists_result))
     response = {
         'count': len(data),
         "data": data
     }
-    return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+    return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''),
+                           facets=genre_facets(Artist), genre=genre)
 
 
-@app.route('/artists/<int:artist_id>')
+@route('/artists/<int:artist_id>')
+@read_only
 def show_artist(artist_id):
-    artist_result = Artist.query.get(artist_id)
-    if not artist_result:
+    etag, last_modified = detail_validators(Artist, Show.artist_id, Venue, Show.venue_id, artist_id)
+    if etag is None:
         return render_template('errors/404.html')
 
-    artist_detail = Artist.allDetail(artist_result)
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    # past shows
-    past_shows_result = Show.query.join(Artist).filter(
-        Show.artist_id == artist_id).filter(Show.start_time <= current_time)
-    past_shows = list(map(Show.venueDetail, past_shows_result))
-    artist_detail["past_shows"] = past_shows
-    artist_detail["past_shows_count"] = len(past_shows)
-    # upcoming shows
-    upcoming_shows_result = Show.query.join(Artist).filter(
-        Show.artist_id == artist_id).filter(Show.start_time > current_time)
-    upcoming_shows = list(map(Show.venueDetail, upcoming_shows_result))
-    artist_detail["upcoming_shows"] = upcoming_shows
-    artist_detail["upcoming_shows_count"] = len(upcoming_shows)
-    return render_template('pages/show_artist.html', artist=artist_detail)
+    def render():
+        # versioned by the ETag, so a cached body always matches its validators
+        artist_detail = detail_cache.get_or_build(
+            artist_detail_key(artist_id), lambda: build_artist_detail(artist_id), etag)
+        if not artist_detail:
+            return render_template('errors/404.html')
+        return render_template('pages/show_artist.html', artist=artist_detail)
+    return conditional(etag, last_modified, render)
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+def check_version(model):
+    # an edit form posts the version it was loaded with, so saving it
+    # cannot overwrite an edit made in between
+    version = request.form.get('version', type=int)
+    if version is not None and version != model.version:
+        raise StaleDataError('%s %d is at version %d, the form at %d' % (
+            type(model).__name__, model.id, model.version, version))
+
+
+@route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
     form = ArtistForm()
     artist_result = Artist.query.get(artist_id)
@@ -396,11 +1368,12 @@ def edit_artist(artist_id):
     return render_template('forms/edit_artist.html', form=form, artist=artist_result)
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
     error = False
     artist_result = Artist.query.get(artist_id)
     try:
+        check_version(artist_result)
         artist_result.name = request.form['name']
         artist_result.city = request.form['city']
         artist_result.state = request.form['state']
@@ -412,12 +1385,19 @@ def edit_artist_submission(artist_id):
         artist_result.seeking_venue=True if 'seeking_venue' in request.form else False
         artist_result.seeking_description=request.form['seeking_description']
         db.session.commit()
+        detail_cache.delete(*related_detail_keys(artist_id=artist_id))
+    except StaleDataError:
+        error = 'stale'
+        db.session.rollback()
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        current_app.logger.exception('%s failed', request.endpoint)
     finally:
         db.session.close()
+    if error == 'stale':
+        flash('Artist ' + request.form['name'] + ' was modified by someone else. Review their changes and try again.')
+        return redirect(url_for('edit_artist', artist_id=artist_id))
     if error:
         flash('An error occurred. Aritist ' +
               request.form['name'] + ' could not be updated.')
@@ -426,7 +1406,7 @@ def edit_artist_submission(artist_id):
     return redirect(url_for('show_artist', artist_id=artist_id))
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
     form = VenueForm()
     venue_result = Venue.query.get(venue_id)
@@ -445,13 +1425,14 @@ def edit_venue(venue_id):
     return render_template('forms/edit_venue.html', form=form, venue=venue_result)
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
     error = False
     venue_result = Venue.query.get(venue_id)
     if not venue_result:
         return render_template('errors/404.html')
     try:
+        check_version(venue_result)
         venue_result.name = request.form['name']
         venue_result.city = request.form['city']
         venue_result.state = request.form['state']
@@ -462,12 +1443,19 @@ def edit_venue_submission(venue_id):
         venue_result.image_link = request.form['image_link']
         venue_result.website = request.form['website']
         db.session.commit()
+        detail_cache.delete(*related_detail_keys(venue_id=venue_id))
+    except StaleDataError:
+        error = 'stale'
+        db.session.rollback()
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        current_app.logger.exception('%s failed', request.endpoint)
     finally:
         db.session.close()
+    if error == 'stale':
+        flash('Venue ' + request.form['name'] + ' was modified by someone else. Review their changes and try again.')
+        return redirect(url_for('edit_venue', venue_id=venue_id))
     if error:
         flash('An error occurred. Venue ' +
               request.form['name'] + ' could not be updated.')
@@ -479,13 +1467,13 @@ def edit_venue_submission(venue_id):
 #  ----------------------------------------------------------------
 
 
-@app.route('/artists/create', methods=['GET'])
+@route('/artists/create', methods=['GET'])
 def create_artist_form():
     form = ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
-@app.route('/artists/create', methods=['POST'])
+@route('/artists/create', methods=['POST'])
 def create_artist_submission():
     error = False
     try:
@@ -506,7 +1494,7 @@ def create_artist_submission():
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        current_app.logger.exception('%s failed', request.endpoint)
     finally:
         db.session.close()
     if error:
@@ -520,64 +1508,604 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@route('/shows')
+@read_only
 def shows():
-    shows_result = Show.query.all()
-    data = list(map(Show.allDetail, shows_result))
-    return render_template('pages/shows.html', shows=data)
-
-
-@app.route('/shows/create')
+    query = show_listing_query().add_columns(
+        Artist.version.label('artist_version'), Venue.version.label('venue_version'),
+        Show.created_at, Artist.updated_at.label('artist_updated_at'), Venue.updated_at.label('venue_updated_at'))
+    page = paginate_request(query, show_listing_order, current_app.config['SHOWS_PER_PAGE'])
+    images = thumbnails.states(show.artist_image_link for show in page.items)
+    # the page's rows and the thumbnails they link are all it renders, so
+    # they are its validators
+    etag = make_etag('shows', page.next_cursor, page.prev_cursor, sorted(images.items()),
+                     [(show.id, show.artist_version, show.venue_version) for show in page.items])
+    last_modified = latest(thumbnails_time(images), *[
+        time for show in page.items for time in (show.created_at, show.artist_updated_at, show.venue_updated_at)])
+    data = [dict(show_tile_detail(show), thumbnails=images.get(show.artist_image_link)) for show in page.items]
+    return conditional(etag, last_modified, lambda: stream_template('pages/shows.html', shows=data, page=page))
+
+
+@route('/shows/create')
 def create_shows():
     # renders form. do not touch.
     form = ShowForm()
     return render_template('forms/new_show.html', form=form)
 
 
-@app.route('/shows/create', methods=['POST'])
+@route('/shows/create', methods=['POST'])
 def create_show_submission():
     error = False
+    rejected = {}
     try:
-        new_show = Show(
-            venue_id=request.form['venue_id'],
-            artist_id=request.form['artist_id'],
-            start_time=request.form['start_time']
-        )
-        db.session.add(new_show)
-        db.session.commit()
+        _, rejected = schedule_records([(1, request.form)])
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        current_app.logger.exception('%s failed', request.endpoint)
     finally:
         db.session.close()
     if error:
         flash('An error occurred. Show could not be listed.')
+    elif rejected:
+        flash('Show could not be listed: %s' % ' '.join(
+            message for messages in rejected[1].values() for message in messages))
     else:
         flash('Show was successfully listed!')
     return render_template('pages/home.html')
 
 
-@app.errorhandler(404)
+@route('/shows/schedule', methods=['GET'])
+def schedule_shows_form():
+    form = ScheduleShowsForm()
+    return render_template('forms/schedule_shows.html', form=form, rejected=None)
+
+
+@route('/shows/schedule', methods=['POST'])
+def schedule_shows_submission():
+    form = ScheduleShowsForm()
+    records = list(read_records(io.StringIO(request.form.get('shows', '')), 'csv'))
+    if len(records) > current_app.config['SCHEDULE_MAX_SHOWS']:
+        flash('At most %d shows can be scheduled at once.' % current_app.config['SCHEDULE_MAX_SHOWS'])
+        return render_template('forms/schedule_shows.html', form=form, rejected=None)
+    rejected = None
+    try:
+        scheduled, rejected = schedule_records(records)
+        flash('%d shows were listed, %d could not be.' % (len(scheduled), len(rejected)))
+    except:
+        db.session.rollback()
+        current_app.logger.exception('%s failed', request.endpoint)
+        flash('An error occurred. No shows were listed.')
+    finally:
+        db.session.close()
+    records = dict(records)
+    rejected = rejected and [(line_number, records[line_number], errors)
+                             for line_number, errors in sorted(rejected.items())]
+    return render_template('forms/schedule_shows.html', form=form, rejected=rejected)
+
+
+#  API
+#  ----------------------------------------------------------------
+
+def api_page_size():
+    limit = request.args.get('limit', current_app.config['API_PER_PAGE'], type=int)
+    return max(1, min(limit, current_app.config['API_MAX_PER_PAGE']))
+
+
+@route('/api/v1/venues')
+@read_only
+def api_venues():
+    query = genre_filter(venue_listing_query(), Venue, request.args.get('genre'))
+    page = paginate_request(query, venue_listing_order, api_page_size())
+    return jsonify(page.toDict(venue_listing_detail))
+
+
+@route('/api/v1/artists')
+@read_only
+def api_artists():
+    query = genre_filter(artist_listing_query(), Artist, request.args.get('genre'))
+    page = paginate_request(query, artist_listing_order, api_page_size())
+    return jsonify(page.toDict(artist_listing_detail))
+
+
+@route('/api/v1/shows')
+@read_only
+def api_shows():
+    page = paginate_request(show_listing_query(), show_listing_order, api_page_size())
+    return jsonify(page.toDict(show_listing_detail))
+
+
+@route('/api/v1/venues/<int:venue_id>')
+@read_only
+def api_venue(venue_id):
+    venue_detail = detail_cache.get_or_build(
+        venue_detail_key(venue_id), lambda: build_venue_detail(venue_id))
+    if not venue_detail:
+        return jsonify({'error': 'Venue %d not found' % venue_id}), 404
+    return jsonify(venue_detail)
+
+
+@route('/api/v1/artists/<int:artist_id>')
+@read_only
+def api_artist(artist_id):
+    artist_detail = detail_cache.get_or_build(
+        artist_detail_key(artist_id), lambda: build_artist_detail(artist_id))
+    if not artist_detail:
+        return jsonify({'error': 'Artist %d not found' % artist_id}), 404
+    return jsonify(artist_detail)
+
+
+@route('/api/v1/venues/search')
+@read_only
+def api_search_venues():
+    venue_result = venue_search.search(
+        genre_filter(Venue.query, Venue, request.args.get('genre')), request.args.get('search_term', ''),
+        current_app.config['SEARCH_RESULTS_LIMIT']).all()
+    venues = list(map(Venue.shortDetail, venue_result))
+    return jsonify({
+        "count": len(venues),
+        "data": venues
+    })
+
+
+@route('/api/v1/venues/availability')
+@read_only
+def api_venue_availability():
+    form, results = availability_request()
+    if results is None:
+        return jsonify({'errors': form.errors or {'city': ['This field is required.']}}), 400
+    count, venues = results
+    return jsonify({
+        "count": count,
+        "data": [dict(id=venue.id, name=venue.name, free_days=[day.isoformat() for day in free_days])
+                 for venue, free_days in venues]
+    })
+
+
+@route('/api/v1/artists/search')
+@read_only
+def api_search_artists():
+    artists_result = artist_search.search(
+        genre_filter(Artist.query, Artist, request.args.get('genre')), request.args.get('search_term', ''),
+        current_app.config['SEARCH_RESULTS_LIMIT']).all()
+    data = list(map(Artist.shortDetail, artists_result))
+    return jsonify({
+        "count": len(data),
+        "data": data
+    })
+
+
+@route('/api/v1/genres')
+@read_only
+def api_genres():
+    venues, artists = genre_facets(Venue), genre_facets(Artist)
+    return jsonify({
+        "data": [{'genre': genre, 'venue_count': venue_count, 'artist_count': artist_count}
+                 for (genre, venue_count), (_, artist_count) in zip(venues, artists)]
+    })
+
+
+@route('/api/v1/shows/batch', methods=['POST'])
+def api_schedule_shows():
+    shows = request.get_json(silent=True)
+    if not isinstance(shows, list) or not all(isinstance(show, dict) for show in shows):
+        return jsonify({'error': 'Expected a JSON array of shows'}), 400
+    if len(shows) > current_app.config['SCHEDULE_MAX_SHOWS']:
+        return jsonify({'error': 'At most %d shows per batch' % current_app.config['SCHEDULE_MAX_SHOWS']}), 413
+    try:
+        # shows are numbered from 0, in the order given
+        scheduled, rejected = schedule_records(enumerate(shows))
+    except:
+        db.session.rollback()
+        current_app.logger.exception('%s failed', request.endpoint)
+        return jsonify({'error': 'An error occurred. No shows were listed.'}), 500
+    finally:
+        db.session.close()
+    return jsonify({
+        'scheduled': scheduled,
+        'rejected': [{'index': index, 'errors': errors} for index, errors in sorted(rejected.items())]
+    })
+
+
+def export_response(query, order_by):
+    # rows stream from a server-side cursor straight into the response
+    format = request.args.get('format', 'json')
+    if format not in STREAM_FORMATS:
+        abort(400)
+    fields = [column['name'] for column in query.column_descriptions]
+    rows = query.order_by(*order_by).execution_options(
+        stream_results=True).yield_per(current_app.config['API_EXPORT_BATCH_SIZE'])
+    chunks = stream_rows(rows, row_encoder(fields), format, current_app.config['API_EXPORT_BATCH_SIZE'])
+    return Response(stream_with_context(chunks), mimetype=STREAM_FORMATS[format])
+
+
+@route('/api/v1/venues/export')
+@read_only
+def api_export_venues():
+    return export_response(db.session.query(
+        Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.phone,
+        Venue.image_link, Venue.genres, Venue.facebook_link, Venue.website,
+        Venue.seeking_talent, Venue.seeking_description
+    ), (Venue.id,))
+
+
+@route('/api/v1/artists/export')
+@read_only
+def api_export_artists():
+    return export_response(db.session.query(
+        Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone,
+        Artist.genres, Artist.image_link, Artist.website, Artist.facebook_link,
+        Artist.seeking_venue, Artist.seeking_description
+    ), (Artist.id,))
+
+
+@route('/api/v1/shows/export')
+@read_only
+def api_export_shows():
+    return export_response(show_listing_query(), show_listing_order)
+
+
+@route('/api/v1/stats/cache')
+def api_cache_stats():
+    if not current_app.config.get('CACHE_STATS_ENDPOINT'):
+        abort(404)
+    return jsonify(detail_cache.stats())
+
+
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
 
-@app.errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+@click.command('explain')
+@click.option('--verbose', is_flag=True, help='Print every query plan.')
+@with_appcontext
+def explain_command(verbose):
+    """Fail if a route's queries read the Show table without an index."""
+    venue = Venue.query.order_by(Venue.id).first()
+    artist = Artist.query.order_by(Artist.id).first()
+    if not venue or not artist:
+        raise click.ClickException('Seed the database before checking query plans.')
+    routes = [
+        ('GET', '/venues', None),
+        ('GET', '/artists', None),
+        ('GET', '/shows', None),
+        ('GET', '/venues/%d' % venue.id, None),
+        ('GET', '/artists/%d' % artist.id, None),
+        ('POST', '/venues/search', {'search_term': venue.name}),
+        ('POST', '/artists/search', {'search_term': artist.name}),
+        ('GET', '/venues/areas/%s/%s' % (quote(venue.state, safe=''), quote(venue.city, safe='')), None),
+    ]
+    # a month from today, so the window reads the upcoming shows
+    today = datetime.now().date()
+    availability = {'city': venue.city, 'state': venue.state, 'first_day': today.isoformat(),
+                    'last_day': (today + timedelta(days=30)).isoformat()}
+    routes.append(('GET', '/venues/availability?' + urlencode(availability), None))
+    genre = (venue.genres or artist.genres or [None])[0]
+    if genre:
+        routes.extend([
+            ('GET', '/venues/availability?' + urlencode(dict(availability, genre=genre)), None),
+            ('GET', '/venues?' + urlencode({'genre': genre}), None),
+            ('GET', '/artists?' + urlencode({'genre': genre}), None),
+            ('POST', '/venues/search', {'search_term': venue.name, 'genre': genre}),
+            ('POST', '/artists/search', {'search_term': artist.name, 'genre': genre}),
+        ])
+    db.session.close()
+
+    engines = [db.engine] + [db.get_engine(bind=key) for key in current_app.extensions['replicas'].keys]
+    try:
+        results = check_routes(current_app._get_current_object(), engines, routes)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    failures = 0
+    for url, statement, plan, scanned in results:
+        if scanned:
+            failures += 1
+            click.echo('Unindexed scan on %s in %s:' % (', '.join(scanned), url), err=True)
+        if scanned or verbose:
+            click.echo(statement)
+            click.echo('\n'.join('    ' + line for line in plan))
+    if failures:
+        raise click.ClickException('%d queries scan the Show table without an index.' % failures)
+    click.echo('All route queries use an index on Show.')
+
+def import_flag(value):
+    return str(value).strip().lower() in ('1', 'true', 't', 'y', 'yes')
+
+
+def venue_import_row(record, data):
+    return (data['name'], data['city'], data['state'], data['address'], data['phone'],
+            data['image_link'], data['genres'], data['facebook_link'], data['website'],
+            import_flag(record.get('seeking_talent')), record.get('seeking_description') or '',
+            search_document(data['name'], data['city'], data['state'], data['genres']))
+
+
+def artist_import_row(record, data):
+    return (data['name'], data['city'], data['state'], data['phone'], data['genres'],
+            data['image_link'], data['website'], data['facebook_link'],
+            data['seeking_venue'], data['seeking_description'] or '',
+            search_document(data['name'], data['city'], data['state'], data['genres']))
+
+
+IMPORTS = {
+    'venues': (VenueForm, Venue.__table__, (
+        'name', 'city', 'state', 'address', 'phone', 'image_link', 'genres', 'facebook_link',
+        'website', 'seeking_talent', 'seeking_description', 'search_document'), venue_import_row),
+    'artists': (ArtistForm, Artist.__table__, (
+        'name', 'city', 'state', 'phone', 'genres', 'image_link', 'website', 'facebook_link',
+        'seeking_venue', 'seeking_description', 'search_document'), artist_import_row),
+    'shows': (ShowForm, Show.__table__, ('artist_id', 'venue_id', 'start_time'), None),
+}
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTS)))
+@click.argument('source', type=click.File('r'))
+@click.option('--format', type=click.Choice(IMPORT_FORMATS),
+              help='Input format; guessed from the file extension by default.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows written per transaction.')
+@click.option('--rejects', type=click.File('w'), help='Write rejected rows and their errors here as NDJSON.')
+@click.option('--workers', default=os.cpu_count(), show_default=True, help='Processes validating rows.')
+@with_appcontext
+def import_command(kind, source, format, batch_size, rejects, workers):
+    """Bulk load venues, artists or shows from a CSV or NDJSON file.
+
+    Show rows reference their venue and artist with venue_id/artist_id or,
+    failing that, venue_name/artist_name. They are scheduled like shows
+    listed on the site: a row overlapping another booking of its venue or
+    artist is rejected.
+    """
+    form_class, table, columns, to_row = IMPORTS[kind]
+    format = format or detect_format(source.name)
+    venues, artists = Resolver(db.session, Venue), Resolver(db.session, Artist)
+    counts = {'imported': 0, 'rejected': 0}
+
+    def reject(line_number, record, errors):
+        counts['rejected'] += 1
+        if rejects:
+            rejects.write(json.dumps({'line': line_number, 'record': record, 'errors': errors}) + '\n')
+        else:
+            click.echo('line %d: %s' % (line_number, json.dumps(errors)), err=True)
+
+    def flush(batch):
+        if kind == 'shows':
+            venues.prefetch([r.get('venue_id') for _, r, _ in batch if r.get('venue_id')],
+                            [r.get('venue_name') for _, r, _ in batch if not r.get('venue_id')])
+            artists.prefetch([r.get('artist_id') for _, r, _ in batch if r.get('artist_id')],
+                             [r.get('artist_name') for _, r, _ in batch if not r.get('artist_id')])
+        rows, shows, listed = [], [], []
+        for line_number, record, data in batch:
+            if kind != 'shows':
+                rows.append(to_row(record, data))
+                continue
+            venue_id = venues.resolve(record.get('venue_id'), record.get('venue_name'))
+            artist_id = artists.resolve(record.get('artist_id'), record.get('artist_name'))
+            if venue_id is None or artist_id is None:
+                reject(line_number, record, {
+                    'venue_id' if venue_id is None else 'artist_id': ['Unknown reference']})
+                continue
+            shows.append((venue_id, artist_id, data['start_time']))
+            listed.append((line_number, record))
+        connection = db.session.connection()
+        if kind == 'shows':
+            # booked like the shows listed on the site, so an import cannot
+            # double-book a venue or artist either
+            scheduled, conflicts = schedule_shows(connection, shows)
+            for position, errors in sorted(conflicts.items()):
+                reject(listed[position][0], listed[position][1], errors)
+            rows = [shows[position] for position in scheduled]
+        else:
+            write_rows(connection, table, columns, rows)
+            adjust_genre_counts(connection, Venue if kind == 'venues' else Artist,
+                                genre_deltas(added=[data['genres'] for _, _, data in batch]))
+        if kind == 'venues':
+            refresh_areas(connection, [(row[1], row[2]) for row in rows])
+        db.session.commit()
+        if kind == 'shows':
+            detail_cache.delete(*set(
+                [venue_detail_key(row[0]) for row in rows] + [artist_detail_key(row[1]) for row in rows]))
+        counts['imported'] += len(rows)
+
+    started = time.time()
+    batch = []
+    validated = validate_records(current_app._get_current_object(), read_records(source, format), form_class,
+                                 list_fields=('genres',), workers=workers)
+    for line_number, record, data, errors in validated:
+        if errors:
+            reject(line_number, record, errors)
+            continue
+        batch.append((line_number, record, data))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    elapsed = max(time.time() - started, 1e-6)
+    click.echo('Imported %d %s, rejected %d (%.0f rows/s).' % (
+        counts['imported'], kind, counts['rejected'],
+        (counts['imported'] + counts['rejected']) / elapsed))
+
+@click.group('counters')
+def counters_command():
+    """Maintain the upcoming/past show counters of venues and artists."""
+
+
+@counters_command.command('rollover')
+@click.option('--every', type=int, help='Keep running, rolling over every SECONDS.')
+@with_appcontext
+def rollover_command(every):
+    """Move shows that have started from the upcoming to the past counts."""
+    while True:
+        moved = roll_over_show_counts(db.session.connection())
+        db.session.commit()
+        click.echo('Rolled %d shows over to past.' % moved)
+        if not every:
+            break
+        time.sleep(every)
+
+
+@counters_command.command('reconcile')
+@click.option('--fix', is_flag=True, help='Overwrite wrong counters with the actual counts.')
+@with_appcontext
+def reconcile_command(fix):
+    """Check the show counters against the Show table."""
+    stale = 0
+    for model, counted_id, stored, actual in stale_show_counts(db.session.connection(), fix):
+        stale += 1
+        click.echo('%s %d: upcoming/past %d/%d, actual %d/%d' % (
+            (model.__tablename__, counted_id) + tuple(stored) + tuple(actual)), err=True)
+    db.session.commit()
+    if stale and not fix:
+        raise click.ClickException('%d stale counters; run with --fix to correct them.' % stale)
+    click.echo('%d counters %s.' % (stale, 'fixed' if fix else 'stale'))
+
+@click.group('areas')
+def areas_command():
+    """Maintain the venue area directory."""
+
+
+@areas_command.command('rebuild')
+@with_appcontext
+def rebuild_areas_command():
+    """Recompute every area of the venue directory."""
+    areas = rebuild_areas(db.session.connection())
+    db.session.commit()
+    click.echo('Rebuilt %d areas.' % areas)
+
+
+@click.group('genres')
+def genres_command():
+    """Maintain the genre facet counts."""
+
+
+@genres_command.command('rebuild')
+@with_appcontext
+def rebuild_genres_command():
+    """Recount the venues and artists in every genre."""
+    genres = rebuild_genre_counts(db.session.connection())
+    db.session.commit()
+    click.echo('Rebuilt the counts of %d genres.' % genres)
+
+
+@click.group('assets')
+def assets_command():
+    """Build the static asset bundles."""
+
+
+@assets_command.command('build')
+@with_appcontext
+def build_assets_command():
+    """Bundle, minify and precompress the static CSS and JavaScript."""
+    manifest = build_assets(current_app.static_folder, current_app.config['ASSETS_DIR'],
+                            static_url_path=current_app.static_url_path)
+    for name, filename in sorted(manifest.items()):
+        click.echo('%s -> %s' % (name, filename))
+
+
+@click.group('thumbnails')
+def thumbnails_command():
+    """Maintain the image thumbnail cache."""
+
+
+@thumbnails_command.command('fetch')
+@click.option('--all', 'refetch', is_flag=True, help='Fetch images that already have thumbnails too.')
+@with_appcontext
+def fetch_thumbnails_command(refetch):
+    """Fetch and thumbnail the image of every venue and artist."""
+    cache = current_app.extensions['thumbnails']
+    links = db.session.query(Venue.image_link).union(db.session.query(Artist.image_link))
+    fetched = failed = 0
+    for link, in links:
+        if not link or (cache.has(link) and not refetch):
+            continue
+        try:
+            cache.fetch(link)
+            fetched += 1
+        except ImageFetchError as error:
+            click.echo(str(error), err=True)
+            failed += 1
+    click.echo('Fetched %d images, %d failed.' % (fetched, failed))
+
+
+@thumbnails_command.command('evict')
+@click.option('--every', type=int, help='Keep running, evicting every SECONDS.')
+@with_appcontext
+def evict_thumbnails_command(every):
+    """Trim the cache to THUMBNAIL_CACHE_MAX_BYTES, least recently used images first."""
+    cache = current_app.extensions['thumbnails']
+    while True:
+        click.echo('Evicted %d images.' % cache.evict())
+        if not every:
+            break
+        time.sleep(every)
+
+#----------------------------------------------------------------------------#
+# App factory.
+#----------------------------------------------------------------------------#
+
+def create_app(config=None):
+    '''Build the app from config.py, the environment and `config` overrides.'''
+    app = Flask(__name__)
+    app.config.from_object('config')
+    if config:
+        app.config.update(config)
+    configure_database(app.config)
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = instance_secret_key(app)
+    app.json_encoder = JSONEncoder
+
+    moment.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    replica_router.init_app(app)
+    app.extensions['fan_out'] = QueryFanOut(app.config['DB_FAN_OUT_WORKERS'])
+    sql_instrumentation.init_app(app)
+    metrics.init_app(app)
+    app.extensions['detail_cache'] = create_cache(app.config)
+    metrics.instrument_cache(app, app.extensions['detail_cache'], 'detail')
+    # rendered tiles are cheap to rebuild, so they stay in-process even
+    # when the detail cache is shared
+    app.extensions['fragment_cache'] = Cache(
+        LRUBackend(app.config['FRAGMENT_CACHE_MAX_ENTRIES']), app.config['FRAGMENT_CACHE_TIMEOUT'])
+    metrics.instrument_cache(app, app.extensions['fragment_cache'], 'fragment')
+    assets.init_app(app)
+    compression.init_app(app)
+    thumbnails.init_app(app)
+
+    template_cache_dir = app.config['TEMPLATE_CACHE_DIR'] or os.path.join(app.instance_path, 'jinja')
+    os.makedirs(template_cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(template_cache_dir)
+    app.jinja_env.filters['datetime'] = format_datetime
+    app.jinja_env.globals['cached_fragment'] = cached_fragment
+    for rule, view, options in routes:
+        app.add_url_rule(rule, view.__name__, view, **options)
+    app.register_error_handler(404, not_found_error)
+    app.register_error_handler(500, server_error)
+    app.cli.add_command(explain_command)
+    app.cli.add_command(import_command)
+    app.cli.add_command(counters_command)
+    app.cli.add_command(areas_command)
+    app.cli.add_command(genres_command)
+    app.cli.add_command(assets_command)
+    app.cli.add_command(thumbnails_command)
+
+    if not app.debug:
+        file_handler = FileHandler('error.log')
+        file_handler.setFormatter(
+            Formatter(
+                '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+        )
+        app.logger.setLevel(logging.INFO)
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+        app.logger.info('errors')
+    return app
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -585,11 +2113,11 @@ if not app.debug:
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
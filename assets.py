@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from flask import current_app, request, send_from_directory, url_for
+
+#----------------------------------------------------------------------------#
+# Static asset bundles.
+#
+# `flask assets build` concatenates and minifies the files of each bundle
+# into ASSETS_DIR under a content-hashed name, next to gzip and brotli
+# variants, and records the names in a manifest. Pages link the bundles
+# through asset_urls(); because a bundle's name changes with its content,
+# /assets/ serves it as immutable with a far-future lifetime.
+#----------------------------------------------------------------------------#
+
+# Source files, relative to the static folder, in load order. A bundle is
+# served from /assets/, not from next to its sources, so the relative
+# url()s in the stylesheets are rewritten to point back into /static/.
+BUNDLES = {
+    'main.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    # loaded in <head>, before the page renders
+    'head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js',
+    ],
+    # deferred, so it runs after jQuery in document order
+    'site.js': [
+        'js/script.js',
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js',
+    ],
+    'respond.js': [
+        'js/libs/respond-1.4.2.min.js',
+    ],
+}
+
+MANIFEST = 'manifest.json'
+
+# the URL path bundles are served from
+ASSETS_URL_PATH = '/assets'
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]*)\1\s*\)''')
+
+# Content-Encoding of each precompressed variant, by preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def minify(name, source):
+    # license comments (/*! ... */) are kept
+    if name.endswith('.css'):
+        import rcssmin
+        return rcssmin.cssmin(source, keep_bang_comments=True)
+    import rjsmin
+    return rjsmin.jsmin(source, keep_bang_comments=True)
+
+
+def rebase_urls(source, css, static_url_path):
+    '''Rewrite the relative url()s of the stylesheet `source` to resolve from a bundle.
+
+    The URLs stay relative, so the app may still be mounted below a prefix.
+    '''
+    directory = posixpath.join(static_url_path, posixpath.dirname(source))
+
+    def rebase(match):
+        quote, url = match.groups()
+        if not url or url.startswith(('/', '#', 'data:')) or ':' in url.split('/')[0]:
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(directory, path))
+        return 'url(%s%s%s%s)' % (quote, posixpath.relpath(target, ASSETS_URL_PATH), suffix, quote)
+    return CSS_URL.sub(rebase, css)
+
+
+def write_file(path, data):
+    # written aside and renamed, so a running worker never serves half a file
+    partial = '%s.%d' % (path, os.getpid())
+    with open(partial, 'wb') as output:
+        output.write(data)
+    os.replace(partial, path)
+
+
+def build_assets(static_folder, assets_dir, bundles=BUNDLES, static_url_path='/static'):
+    '''Build every bundle into `assets_dir`; return the new manifest.'''
+    import brotli
+    os.makedirs(assets_dir, exist_ok=True)
+    manifest = {}
+    for name, sources in sorted(bundles.items()):
+        parts = []
+        for source in sources:
+            with open(os.path.join(static_folder, source), encoding='utf-8') as source_file:
+                text = source_file.read()
+            if name.endswith('.css'):
+                text = rebase_urls(source, text, static_url_path)
+            parts.append(minify(name, text))
+        # a script without a trailing semicolon must not run into the next
+        separator = '\n' if name.endswith('.css') else ';\n'
+        data = separator.join(parts).encode('utf-8')
+        stem, extension = os.path.splitext(name)
+        filename = '%s.%s%s' % (stem, hashlib.sha256(data).hexdigest()[:12], extension)
+        path = os.path.join(assets_dir, filename)
+        write_file(path, data)
+        # mtime=0 keeps the gzip output identical between builds
+        write_file(path + '.gz', gzip.compress(data, 9, mtime=0))
+        write_file(path + '.br', brotli.compress(data, quality=11))
+        manifest[name] = filename
+    write_file(os.path.join(assets_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(assets_dir):
+    try:
+        with open(os.path.join(assets_dir, MANIFEST)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+class Assets(object):
+    '''Link and serve the built bundles.
+
+    Without a build, and always in debug mode so that edits show up on
+    reload, pages link the bundles' source files from the static folder
+    instead.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_DIR', os.path.join(app.static_folder, 'dist'))
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        app.extensions['assets'] = load_manifest(app.config['ASSETS_DIR'])
+        app.add_url_rule(ASSETS_URL_PATH + '/<path:filename>', 'assets', self.send_asset)
+        app.jinja_env.globals['asset_urls'] = self.urls
+
+    def urls(self, bundle):
+        '''Return the URLs to link for `bundle`, in load order.'''
+        manifest = current_app.extensions['assets']
+        if manifest and not current_app.debug:
+            return [url_for('assets', filename=manifest[bundle])]
+        return [url_for('static', filename=source) for source in BUNDLES[bundle]]
+
+    def send_asset(self, filename):
+        assets_dir = current_app.config['ASSETS_DIR']
+        mimetype = mimetypes.guess_type(filename)[0]
+        encoding, suffix = None, ''
+        for candidate, candidate_suffix in ENCODINGS:
+            if request.accept_encodings[candidate] and os.path.isfile(
+                    os.path.join(assets_dir, filename + candidate_suffix)):
+                encoding, suffix = candidate, candidate_suffix
+                break
+        response = send_from_directory(
+            assets_dir, filename + suffix, mimetype=mimetype, max_age=current_app.config['ASSETS_MAX_AGE'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        # the name changes with the content, so a cached copy never goes stale
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % current_app.config['ASSETS_MAX_AGE']
+        return response
@@ -0,0 +1,25 @@
+import os
+
+#----------------------------------------------------------------------------#
+# Benchmark suite.
+#
+#   python -m benchmarks seed --venues 5000 --artists 20000 --shows 1000000
+#   python -m benchmarks run --save benchmarks/baseline.json
+#   python -m benchmarks run --compare benchmarks/baseline.json
+#   python -m benchmarks micro
+#
+# Everything runs in-process against the database given by --database-url
+# or DATABASE_URL (PostgreSQL or SQLite), with no network access.
+#----------------------------------------------------------------------------#
+
+
+def load_app(database_url=None):
+    '''Return the Fyyur app module and an app bound to `database_url`.
+
+    Pool settings come from the DB_* environment variables, so runs with
+    different pool sizes can be compared without editing config.py.
+    '''
+    import app as fyyur
+    database_url = database_url or os.environ.get('DATABASE_URL')
+    config = {'SQLALCHEMY_DATABASE_URI': database_url} if database_url else None
+    return fyyur, fyyur.create_app(config)
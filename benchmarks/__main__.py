@@ -0,0 +1,81 @@
+import sys
+from datetime import datetime
+import click
+from benchmarks import load_app
+
+
+@click.group()
+@click.option('--database-url', envvar='DATABASE_URL',
+              help='Database to benchmark; defaults to the app configuration.')
+@click.pass_context
+def cli(context, database_url):
+    context.obj = database_url
+
+
+@cli.command()
+@click.option('--venues', default=2000, show_default=True)
+@click.option('--artists', default=5000, show_default=True)
+@click.option('--shows', default=100000, show_default=True)
+@click.option('--seed', default=1, show_default=True, help='Random seed; equal seeds give equal catalogs.')
+@click.option('--now', type=click.DateTime(['%Y-%m-%d']), help='Reference date for show times (default today).')
+@click.option('--reset', is_flag=True, help='Drop all tables first.')
+@click.pass_obj
+def seed(database_url, venues, artists, shows, seed, now, reset):
+    """Fill the database with a deterministic synthetic catalog."""
+    from benchmarks.generate import seed as seed_catalog
+    fyyur, app = load_app(database_url)
+    started = datetime.now()
+    seed_catalog(fyyur, app, venues, artists, shows, seed=seed, reset=reset, now=now)
+    click.echo('Seeded %d venues, %d artists and %d shows in %s.' % (
+        venues, artists, shows, datetime.now() - started))
+
+
+@cli.command()
+@click.option('--requests', default=100, show_default=True, help='Measured requests per scenario.')
+@click.option('--concurrency', default=1, show_default=True, help='Client threads.')
+@click.option('--warmup', default=5, show_default=True, help='Unmeasured requests per scenario.')
+@click.option('--scenario', 'only', multiple=True, help='Only run the named scenarios.')
+@click.option('--save', type=click.Path(dir_okay=False), help='Write the results as a baseline.')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help='Fail on regressions against a baseline.')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed p95 slowdown over the baseline.')
+@click.pass_obj
+def run(database_url, requests, concurrency, warmup, only, save, compare, tolerance):
+    """Drive every route in-process and report latency and SQL counts."""
+    from benchmarks import driver
+    fyyur, app = load_app(database_url)
+    results = driver.run(fyyur, app, requests, concurrency, warmup, only)
+    click.echo(driver.format_results(results))
+    if save:
+        driver.save(results, save)
+    if compare:
+        regressions = driver.compare(results, driver.load(compare), tolerance)
+        for regression in regressions:
+            click.echo('REGRESSION ' + regression, err=True)
+        if regressions:
+            sys.exit(1)
+
+
+@cli.command()
+@click.option('--levels', default='1,2,4,8,16', show_default=True, help='Client concurrency levels.')
+@click.option('--requests', default=200, show_default=True, help='Measured requests per level.')
+@click.pass_obj
+def sweep(database_url, levels, requests):
+    """Compare sequential and fanned-out detail page queries under load."""
+    from benchmarks import driver
+    fyyur, app = load_app(database_url)
+    levels = [int(level) for level in levels.split(',')]
+    click.echo(driver.format_sweep(driver.sweep(fyyur, app, levels, requests)))
+
+
+@cli.command()
+@click.pass_obj
+def micro(database_url):
+    """Time hot helpers in isolation (per-call microseconds)."""
+    from benchmarks import micro as micro_benchmarks
+    fyyur, _ = load_app(database_url)
+    for name, microseconds in sorted(micro_benchmarks.datetime_filter(fyyur).items()):
+        click.echo('datetime filter (%s): %.2f us/tile' % (name, microseconds))
+
+
+if __name__ == '__main__':
+    cli()
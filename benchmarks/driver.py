@@ -0,0 +1,224 @@
+import json
+import math
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from urllib.parse import quote, urlencode
+from concurrent.futures import ThreadPoolExecutor
+from pagination import encode_cursor
+
+#----------------------------------------------------------------------------#
+# In-process load driver.
+#
+# Requests go straight into the WSGI app through the Flask test client, so
+# the numbers measure routing, queries and rendering without any network or
+# server in between. SQL statements are counted per request from the
+# Server-Timing header the SQL instrumentation adds, which also covers
+# statements fanned out to other threads, and is what catches N+1
+# regressions before latency does.
+#----------------------------------------------------------------------------#
+
+Scenario = namedtuple('Scenario', 'name method path data headers')
+Scenario.__new__.__defaults__ = (None,)
+
+QUERY_COUNT = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def statement_count(response):
+    match = QUERY_COUNT.search(', '.join(response.headers.getlist('Server-Timing')))
+    return int(match.group(1)) if match else 0
+
+
+def deep_cursor(query, order_by, per_page):
+    # cursor of the page before the last one, as if a client paged that far
+    row = query.order_by(*[column.desc() for column in order_by]).offset(per_page).first()
+    if row is None:
+        return None
+    return encode_cursor([getattr(row, column.key) for column in order_by], 'next')
+
+
+def scenarios(fyyur, app):
+    '''Build the benchmark scenarios for the catalog in the app's database.'''
+    db, Venue, Artist, Show = fyyur.db, fyyur.Venue, fyyur.Artist, fyyur.Show
+    config = app.config
+    with app.app_context():
+        busiest_venue = db.session.query(Show.venue_id).group_by(Show.venue_id).order_by(
+            db.func.count(Show.id).desc()).first()
+        busiest_artist = db.session.query(Show.artist_id).group_by(Show.artist_id).order_by(
+            db.func.count(Show.id).desc()).first()
+        venue = Venue.query.order_by(Venue.id).first()
+        artist = Artist.query.order_by(Artist.id).first()
+        if not (busiest_venue and busiest_artist and venue and artist):
+            raise RuntimeError('Seed the database before running benchmarks.')
+        cursors = {
+            'venues': deep_cursor(fyyur.area_listing_query(), fyyur.area_listing_order,
+                                  config['AREAS_PER_PAGE']),
+            'artists': deep_cursor(fyyur.artist_listing_query(), fyyur.artist_listing_order,
+                                   config['ARTISTS_PER_PAGE']),
+            'shows': deep_cursor(fyyur.show_listing_query(), fyyur.show_listing_order,
+                                 config['SHOWS_PER_PAGE']),
+        }
+        busiest_area = db.session.query(fyyur.Area.state, fyyur.Area.city).order_by(
+            fyyur.Area.venue_count.desc()).first()
+        venue_term, artist_term = venue.city, artist.name.split()[0]
+        busiest_genre = db.session.query(fyyur.GenreCount.genre).order_by(
+            (fyyur.GenreCount.venue_count + fyyur.GenreCount.artist_count).desc()).first()
+        today = date.today()
+
+    result = [
+        Scenario('venues', 'GET', '/venues', None),
+        Scenario('artists', 'GET', '/artists', None),
+        Scenario('shows', 'GET', '/shows', None),
+    ]
+    for name, cursor in sorted(cursors.items()):
+        if cursor:
+            result.append(Scenario('%s (deep page)' % name, 'GET', '/%s?cursor=%s' % (name, cursor), None))
+    result.extend([
+        Scenario('venue_area', 'GET', '/venues/areas/%s/%s' % (
+            quote(busiest_area.state), quote(busiest_area.city)), None),
+        Scenario('show_venue', 'GET', '/venues/%d' % busiest_venue[0], None),
+        Scenario('show_artist', 'GET', '/artists/%d' % busiest_artist[0], None),
+        Scenario('search_venues', 'POST', '/venues/search', {'search_term': venue_term}),
+        Scenario('search_artists', 'POST', '/artists/search', {'search_term': artist_term}),
+        # every evening of the next 90 days in the city with the most venues
+        Scenario('venue_availability', 'GET', '/venues/availability?' + urlencode({
+            'city': busiest_area.city, 'state': busiest_area.state,
+            'first_day': today.isoformat(), 'last_day': (today + timedelta(days=89)).isoformat()}), None),
+        Scenario('api_shows', 'GET', '/api/v1/shows', None),
+    ])
+    if busiest_genre:
+        genre = urlencode({'genre': busiest_genre.genre})
+        result.extend([
+            Scenario('venues (genre)', 'GET', '/venues?' + genre, None),
+            Scenario('artists (genre)', 'GET', '/artists?' + genre, None),
+        ])
+    # a client revalidating its copy of an unchanged page gets a 304
+    client = app.test_client()
+    for scenario in [scenario for scenario in result if scenario.name in ('shows', 'show_venue', 'show_artist')]:
+        etag = client.get(scenario.path).headers.get('ETag')
+        if etag:
+            result.append(scenario._replace(
+                name='%s (revalidated)' % scenario.name, headers={'If-None-Match': etag}))
+    return result
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    # nearest-rank percentile of an already sorted list
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+
+def run_scenario(app, scenario, requests, concurrency, warmup):
+    local = threading.local()
+
+    def request(_):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        started = time.perf_counter()
+        response = client.open(scenario.path, method=scenario.method, data=scenario.data,
+                               headers=scenario.headers)
+        elapsed = time.perf_counter() - started
+        return elapsed, statement_count(response), response.status_code
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(request, range(warmup)))
+        started = time.perf_counter()
+        samples = list(pool.map(request, range(requests)))
+        wall_time = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, _, status in samples if status >= 400),
+        'throughput': requests / wall_time if wall_time else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'statements': max(statements for _, statements, _ in samples),
+    }
+
+
+def run(fyyur, app, requests=100, concurrency=1, warmup=5, only=None):
+    results = {}
+    for scenario in scenarios(fyyur, app):
+        if only and scenario.name not in only:
+            continue
+        app.extensions['detail_cache'].clear()
+        results[scenario.name] = run_scenario(app, scenario, requests, concurrency, warmup)
+    return results
+
+
+def sweep(fyyur, app, levels=(1, 2, 4, 8, 16), requests=200, warmup=5):
+    '''Measure the uncached detail pages at each client concurrency level.
+
+    Runs once with the page queries issued one after another and once with
+    DB_FAN_OUT, returning {mode: {level: {scenario: result}}}. Everything
+    runs in this one process, so the numbers show what a single worker
+    sustains in each mode.
+    '''
+    detail = [scenario for scenario in scenarios(fyyur, app)
+              if scenario.name in ('show_venue', 'show_artist')]
+    cache = app.extensions['detail_cache']
+    default_timeout, fan_out = cache.default_timeout, app.config['DB_FAN_OUT']
+    # a zero timeout stores nothing, so every request runs the page queries
+    cache.default_timeout = 0
+    results = {}
+    try:
+        for mode, enabled in (('sequential', False), ('fan-out', True)):
+            app.config['DB_FAN_OUT'] = enabled
+            results[mode] = dict(
+                (level, dict((scenario.name, run_scenario(app, scenario, requests, level, warmup))
+                             for scenario in detail))
+                for level in levels)
+    finally:
+        cache.default_timeout, app.config['DB_FAN_OUT'] = default_timeout, fan_out
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    '''Return a message for every scenario slower or chattier than `baseline`.'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append('%s: p95 %.1fms vs baseline %.1fms' % (name, result['p95'], base['p95']))
+        if result['statements'] > base['statements']:
+            regressions.append('%s: %d SQL statements vs baseline %d' % (
+                name, result['statements'], base['statements']))
+    return regressions
+
+
+def format_results(results):
+    lines = ['%-26s %8s %8s %8s %9s %6s %6s' % (
+        'scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'sql', 'errors')]
+    for name, result in sorted(results.items()):
+        lines.append('%-26s %8.1f %8.1f %8.1f %9.1f %6d %6d' % (
+            name, result['p50'], result['p95'], result['p99'], result['throughput'],
+            result['statements'], result['errors']))
+    return '\n'.join(lines)
+
+
+def format_sweep(results):
+    lines = ['%-12s %-12s %6s %8s %8s %9s' % ('mode', 'scenario', 'conc', 'p50 ms', 'p95 ms', 'req/s')]
+    for mode, levels in results.items():
+        for level, scenarios_results in sorted(levels.items()):
+            for name, result in sorted(scenarios_results.items()):
+                lines.append('%-12s %-12s %6d %8.1f %8.1f %9.1f' % (
+                    mode, name, level, result['p50'], result['p95'], result['throughput']))
+    return '\n'.join(lines)
+
+
+def save(results, path):
+    with open(path, 'w') as baseline:
+        json.dump(results, baseline, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as baseline:
+        return json.load(baseline)
@@ -0,0 +1,133 @@
+import bisect
+import itertools
+import random
+from datetime import datetime, timedelta
+from forms import genres_choices, state_choices
+from importer import write_rows
+from search import search_document
+
+#----------------------------------------------------------------------------#
+# Synthetic catalog.
+#
+# Deterministic for a given seed and reference date. Popularity follows a
+# Zipf-like law so a few venues and artists carry most of the shows, and a
+# handful of cities hold most of the venues, the way real booking data is
+# skewed.
+#----------------------------------------------------------------------------#
+
+GENRES = [genre for genre, _ in genres_choices]
+STATES = [state for state, _ in state_choices]
+NAME_WORDS = [
+    'Velvet', 'Electric', 'Golden', 'Midnight', 'Crimson', 'Lunar', 'Wild',
+    'Blue', 'Neon', 'Silver', 'Howling', 'Paper', 'Iron', 'Echo', 'Copper'
+]
+VENUE_WORDS = ['Hall', 'Room', 'Lounge', 'Theatre', 'Club', 'Garage', 'Tavern', 'Ballroom']
+ARTIST_WORDS = ['Wolves', 'Saints', 'Collective', 'Trio', 'Kids', 'Machine', 'Orchestra', 'Band']
+
+VENUE_COLUMNS = (
+    'name', 'city', 'state', 'address', 'phone', 'image_link', 'genres', 'facebook_link',
+    'website', 'seeking_talent', 'seeking_description', 'search_document')
+ARTIST_COLUMNS = (
+    'name', 'city', 'state', 'phone', 'genres', 'image_link', 'website', 'facebook_link',
+    'seeking_venue', 'seeking_description', 'search_document')
+SHOW_COLUMNS = ('artist_id', 'venue_id', 'start_time')
+
+
+class ZipfChooser(object):
+    '''Pick indexes in range(n) with probability proportional to 1 / rank**s.'''
+
+    def __init__(self, rng, n, s=1.1):
+        self.rng = rng
+        self.n = n
+        self.cumulative = list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+        self.total = self.cumulative[-1]
+
+    def choose(self):
+        index = bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+        return min(index, self.n - 1)
+
+
+class Catalog(object):
+
+    def __init__(self, seed=1, cities=200):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.cities = [('%s City %d' % (self.rng.choice(NAME_WORDS), i), self.rng.choice(STATES))
+                       for i in range(cities)]
+        self.city_chooser = ZipfChooser(self.rng, cities, s=1.0)
+
+    def name(self, words, number):
+        return '%s %s %d' % (self.rng.choice(NAME_WORDS), self.rng.choice(words), number)
+
+    def genres(self):
+        return sorted(self.rng.sample(GENRES, self.rng.randint(1, 3)))
+
+    def venues(self, count):
+        for number in range(count):
+            city, state = self.cities[self.city_chooser.choose()]
+            name = self.name(VENUE_WORDS, number)
+            genres = self.genres()
+            yield (name, city, state, '%d Main Street' % self.rng.randint(1, 9999),
+                   '%010d' % self.rng.randint(0, 9999999999),
+                   'https://images.example.com/venues/%d.jpg' % number, genres,
+                   'https://www.facebook.com/venue%d' % number,
+                   'https://venue%d.example.com' % number,
+                   self.rng.random() < 0.3, '',
+                   search_document(name, city, state, genres))
+
+    def artists(self, count):
+        for number in range(count):
+            city, state = self.cities[self.city_chooser.choose()]
+            name = self.name(ARTIST_WORDS, number)
+            genres = self.genres()
+            yield (name, city, state, '%010d' % self.rng.randint(0, 9999999999), genres,
+                   'https://images.example.com/artists/%d.jpg' % number,
+                   'https://artist%d.example.com' % number,
+                   'https://www.facebook.com/artist%d' % number,
+                   self.rng.random() < 0.3, '',
+                   search_document(name, city, state, genres))
+
+    def shows(self, count, venue_ids, artist_ids, now=None):
+        # shows spread over the year before and the six months after `now`
+        now = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        venue_chooser = ZipfChooser(self.rng, len(venue_ids))
+        artist_chooser = ZipfChooser(self.rng, len(artist_ids))
+        for _ in range(count):
+            start_time = now + timedelta(hours=self.rng.randint(-365 * 24, 182 * 24))
+            yield (artist_ids[artist_chooser.choose()], venue_ids[venue_chooser.choose()],
+                   start_time.replace(hour=self.rng.choice((18, 19, 20, 21, 22))))
+
+
+def write_batched(connection, table, columns, rows, batch_size=50000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            write_rows(connection, table, columns, batch)
+            batch = []
+    write_rows(connection, table, columns, batch)
+
+
+def seed(fyyur, app, venues, artists, shows, seed=1, reset=False, now=None):
+    '''Fill the database of `app`, built by the `fyyur` module, with a synthetic catalog.'''
+    db = fyyur.db
+    catalog = Catalog(seed)
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+        connection = db.session.connection()
+        write_batched(connection, fyyur.Venue.__table__, VENUE_COLUMNS, catalog.venues(venues))
+        write_batched(connection, fyyur.Artist.__table__, ARTIST_COLUMNS, catalog.artists(artists))
+        venue_ids = [row.id for row in db.session.query(fyyur.Venue.id).order_by(fyyur.Venue.id)]
+        artist_ids = [row.id for row in db.session.query(fyyur.Artist.id).order_by(fyyur.Artist.id)]
+        if venue_ids and artist_ids:
+            write_batched(connection, fyyur.Show.__table__, SHOW_COLUMNS,
+                          catalog.shows(shows, venue_ids, artist_ids, now))
+            list(fyyur.stale_show_counts(connection, fix=True))
+        fyyur.rebuild_areas(connection)
+        fyyur.rebuild_genre_counts(connection)
+        db.session.commit()
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('ANALYZE')
+            db.session.commit()
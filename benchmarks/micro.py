@@ -0,0 +1,42 @@
+import timeit
+from datetime import datetime, timedelta
+import babel.dates
+import dateutil.parser
+
+#----------------------------------------------------------------------------#
+# Micro-benchmarks.
+#----------------------------------------------------------------------------#
+
+
+def legacy_format_datetime(value, format='medium'):
+    # the datetime filter as it was: strftime, re-parse, babel pattern parse
+    date = dateutil.parser.parse(value.strftime('%Y-%m-%d %H:%M:%S'))
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format)
+
+
+def datetime_filter(fyyur, tiles=500, repeat=5):
+    '''Return per-tile microseconds for the legacy and current filters.'''
+    start = datetime(2020, 6, 1, 20, 0)
+    start_times = [start + timedelta(hours=index * 7) for index in range(tiles)]
+
+    def legacy():
+        for start_time in start_times:
+            legacy_format_datetime(start_time, 'full')
+
+    def cold():
+        fyyur.format_native_datetime.cache_clear()
+        for start_time in start_times:
+            fyyur.format_datetime(start_time, 'full')
+
+    def warm():
+        for start_time in start_times:
+            fyyur.format_datetime(start_time, 'full')
+
+    warm()
+    return dict(
+        (name, min(timeit.repeat(function, number=1, repeat=repeat)) / tiles * 1e6)
+        for name, function in (('legacy', legacy), ('cold', cold), ('memoized', warm)))
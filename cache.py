@@ -0,0 +1,129 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+#----------------------------------------------------------------------------#
+# Payload cache.
+#
+# A small cache front-end with hit/miss counters over a pluggable backend:
+# an in-process LRU with per-entry expiry by default, or Redis when several
+# workers need to share entries and invalidations.
+#----------------------------------------------------------------------------#
+
+
+class LRUBackend(object):
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (value, time.time() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend(object):
+
+    def __init__(self, url, prefix='fyyur:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, timeout):
+        self.client.set(self.prefix + key, pickle.dumps(value), px=max(1, int(timeout * 1000)))
+
+    def delete(self, keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class Cache(object):
+
+    def __init__(self, backend, default_timeout=300):
+        self.backend = backend
+        self.default_timeout = default_timeout
+        self.hits = 0
+        self.misses = 0
+        # called with True or False after every lookup, e.g. to export metrics
+        self.on_lookup = None
+
+    def get_or_build(self, key, build, version=None):
+        '''Return the cached value for `key`, or store the result of `build`.
+
+        `build` returns a (value, timeout) pair; a None value is not cached
+        and a None timeout means the default timeout. With a `version`, an
+        entry stored under another version is rebuilt, so a worker whose
+        entry missed an invalidation cannot serve it as the current one.
+        '''
+        entry = self.backend.get(key)
+        hit = entry is not None and (version is None or entry[0] == version)
+        if self.on_lookup is not None:
+            self.on_lookup(hit)
+        if hit:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value, timeout = build()
+        if value is not None:
+            if timeout is None or timeout > self.default_timeout:
+                timeout = self.default_timeout
+            if timeout > 0:
+                self.backend.set(key, (version, value), timeout)
+        return value
+
+    def delete(self, *keys):
+        self.backend.delete(keys)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+        }
+
+
+def create_cache(config):
+    if config.get('CACHE_TYPE') == 'redis':
+        backend = RedisBackend(config['CACHE_REDIS_URL'])
+    else:
+        backend = LRUBackend(config.get('CACHE_MAX_ENTRIES', 1024))
+    return Cache(backend, config.get('CACHE_DEFAULT_TIMEOUT', 300))
@@ -0,0 +1,114 @@
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#----------------------------------------------------------------------------#
+# Response compression.
+#
+# Compresses text responses with brotli or gzip, whichever the client
+# accepts (brotli only when the package is installed). A streamed response
+# is compressed chunk by chunk and each chunk is flushed, so the client
+# still gets the page while it is being rendered.
+#----------------------------------------------------------------------------#
+
+COMPRESSIBLE_MIMETYPES = frozenset([
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/csv',
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson',
+    'image/svg+xml',
+])
+
+
+class GzipEncoder(object):
+
+    def __init__(self, level):
+        # wbits 16 + MAX_WBITS writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def encode(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder(object):
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def encode(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def encoded_chunks(chunks, encoder):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = encoder.encode(chunk)
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        # close the wrapped stream, ending its request context
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class Compression(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 5)
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.gzip_level = app.config['COMPRESS_GZIP_LEVEL']
+        self.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        app.after_request(self.after_request)
+
+    def encoder(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br', BrotliEncoder(self.brotli_quality)
+        if accepted['gzip']:
+            return 'gzip', GzipEncoder(self.gzip_level)
+        return None, None
+
+    def after_request(self, response):
+        if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers or request.method == 'HEAD'):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not response.is_streamed and response.calculate_content_length() < self.min_size:
+            return response
+        encoding, encoder = self.encoder()
+        if encoder is None:
+            return response
+        if response.is_streamed:
+            response.response = encoded_chunks(response.response, encoder)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(encoder.encode(response.get_data()) + encoder.finish())
+        response.headers['Content-Encoding'] = encoding
+        # the compressed bytes differ from the ones a strong ETag names
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
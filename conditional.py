@@ -0,0 +1,45 @@
+import hashlib
+from datetime import timezone
+from flask import Response, current_app, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+#----------------------------------------------------------------------------#
+# Conditional requests.
+#
+# Pages compute their validators, a strong ETag and a Last-Modified time,
+# from a light query before doing any heavy work. A browser or CDN holding
+# the current version gets a 304 without the page being built or rendered.
+#----------------------------------------------------------------------------#
+
+
+def make_etag(*parts):
+    '''Return a strong ETag for `parts` of the deployed RELEASE.'''
+    # the release is part of the tag so new templates are never answered
+    # with a 304 for a page rendered by the old ones
+    key = repr((current_app.config['RELEASE'],) + parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def latest(*times):
+    '''Return the latest of the naive local `times` as an HTTP date, or None.'''
+    times = [time for time in times if time is not None]
+    if not times:
+        return None
+    # HTTP dates are UTC, in whole seconds
+    return max(times).astimezone(timezone.utc).replace(microsecond=0)
+
+
+def conditional(etag, last_modified, render):
+    '''Return `render()` with validators, or a 304 if the client's copy is current.'''
+    if session.get('_flashes'):
+        # a page carrying one-off messages is not a version of the resource
+        return render()
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response(render())
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # caches may store the page but must revalidate it on every request
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,263 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, exc, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import Pool
+
+#----------------------------------------------------------------------------#
+# Database engine settings.
+#
+# Turns the DB_* settings into SQLAlchemy engine options, makes sure a
+# pooled connection is never shared between a parent process and the
+# workers forked from it, routes read-only requests to replicas and fans
+# independent queries out over several pooled connections.
+#----------------------------------------------------------------------------#
+
+REPLICA_BIND_PREFIX = 'replica'
+
+log = logging.getLogger(__name__)
+
+
+def database_url(url):
+    # Heroku still hands out postgres:// URLs, which SQLAlchemy 1.4 rejects
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(config):
+    '''Return SQLALCHEMY_ENGINE_OPTIONS for the DB_* settings in `config`.'''
+    backend = make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    if backend == 'sqlite':
+        # SQLite picks its own pool class, which takes no sizing arguments
+        return options
+    options.update(
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_recycle=config['DB_POOL_RECYCLE'])
+    if backend == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {
+            'options': '-c statement_timeout=%d' % config['DB_STATEMENT_TIMEOUT_MS']}
+    return options
+
+
+def configure_database(config):
+    config['SQLALCHEMY_DATABASE_URI'] = database_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = engine_options(config)
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    # replicas are binds no table belongs to; only the routing session uses them
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for number, url in enumerate(config.get('SQLALCHEMY_REPLICA_URIS') or (), 1):
+        binds['%s%d' % (REPLICA_BIND_PREFIX, number)] = database_url(url)
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+@event.listens_for(Pool, 'connect')
+def remember_connection_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def discard_forked_connection(dbapi_connection, connection_record, connection_proxy):
+    # a connection opened before a fork belongs to the parent: drop it and
+    # let the pool open a fresh one for this process
+    if connection_record.info.get('pid', os.getpid()) != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            'Connection record belongs to pid %s, attempting to check out in pid %s' % (
+                connection_record.info['pid'], os.getpid()))
+
+
+#----------------------------------------------------------------------------#
+# Read replicas.
+#----------------------------------------------------------------------------#
+
+def read_only(view):
+    '''Mark `view` as safe to serve from a read replica.'''
+    view.read_only = True
+    return view
+
+
+class RoutingSession(SignallingSession):
+    '''Send the statements of a read-only request to its chosen replica.'''
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica is not None and not self._flushing:
+            return self.db.get_engine(self.app, bind=replica)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaSet(object):
+    '''Round-robin over the healthy replica binds of an app.
+
+    A replica's health is checked at most every `interval` seconds: it
+    must accept a connection and, on PostgreSQL, replay WAL no more than
+    `max_lag` seconds behind the primary.
+    '''
+
+    def __init__(self, db, app, keys, interval=5, max_lag=30):
+        self.db = db
+        self.app = app
+        self.keys = keys
+        self.interval = interval
+        self.max_lag = max_lag
+        self._turn = itertools.count()
+        self._status = {}
+
+    def choose(self):
+        for _ in self.keys:
+            key = self.keys[next(self._turn) % len(self.keys)]
+            if self.healthy(key):
+                return key
+        return None
+
+    def healthy(self, key):
+        status = self._status.get(key)
+        if status is None or status[1] + self.interval <= time.time():
+            status = self._status[key] = (self.check(key), time.time())
+        return status[0]
+
+    def check(self, key):
+        try:
+            with self.db.get_engine(self.app, bind=key).connect() as connection:
+                if connection.dialect.name != 'postgresql':
+                    connection.execute('SELECT 1')
+                    return True
+                # NULL on a server that is not replaying WAL at all
+                lag = connection.execute(
+                    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END').scalar()
+        except exc.DBAPIError:
+            log.warning('Replica %s failed its health check', key, exc_info=True)
+            return False
+        if lag is not None and lag > self.max_lag:
+            log.warning('Replica %s is %.1fs behind the primary', key, lag)
+            return False
+        return True
+
+
+class ReplicaRouter(object):
+    '''Serve read-only views from replicas, everything else from the primary.
+
+    A client that just committed a write is kept on the primary for
+    REPLICA_STICKY_SECONDS, so the page it is redirected to shows its own
+    write even while the replicas catch up.
+    '''
+
+    def __init__(self, db, app=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REPLICA_HEALTH_INTERVAL', 5)
+        app.config.setdefault('REPLICA_MAX_LAG', 30)
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+        keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or ()
+                      if key.startswith(REPLICA_BIND_PREFIX))
+        app.extensions['replicas'] = ReplicaSet(
+            self.db, app, keys, app.config['REPLICA_HEALTH_INTERVAL'], app.config['REPLICA_MAX_LAG'])
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        if not event.contains(RoutingSession, 'after_commit', self.after_commit):
+            event.listen(RoutingSession, 'after_commit', self.after_commit)
+
+    def before_request(self):
+        replicas = current_app.extensions['replicas']
+        view = current_app.view_functions.get(request.endpoint)
+        if not replicas.keys or not getattr(view, 'read_only', False):
+            return
+        if session.get('primary_until', 0) > time.time():
+            return
+        g.db_replica = replicas.choose()
+
+    def after_commit(self, db_session):
+        if has_app_context():
+            g.db_committed = True
+
+    def after_request(self, response):
+        if g.pop('db_committed', False) and current_app.extensions['replicas'].keys:
+            session['primary_until'] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+        return response
+
+
+#----------------------------------------------------------------------------#
+# Query fan-out.
+#----------------------------------------------------------------------------#
+
+class QueryFanOut(object):
+    '''Run independent queries at once, each on its own pooled connection.
+
+    Every query but the first runs on a worker thread, in a session bound
+    to the engine the request's own session uses (primary or replica).
+    Each worker pushes an app context of its own and carries over the
+    request's `g` values listed in `carried`, so the SQL instrumentation
+    still attributes its statements to the request.
+    '''
+
+    # RequestQueries locks its own updates, so workers may share it
+    carried = ('sql_queries', 'db_replica')
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def executor(self):
+        # threads do not survive a fork, so each worker process starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def all(self, *queries):
+        bind = queries[0].session.get_bind()
+        app = current_app._get_current_object()
+        values = dict((name, g.get(name)) for name in self.carried if name in g)
+
+        def run(query):
+            # an AppContext is not safe to push on several threads at once
+            with app.app_context():
+                for name, value in values.items():
+                    setattr(g, name, value)
+                fan_out_session = orm.Session(bind=bind)
+                try:
+                    return query.with_session(fan_out_session).all()
+                finally:
+                    fan_out_session.close()
+        futures = [self.executor().submit(run, query) for query in queries[1:]]
+        return [queries[0].all()] + [future.result() for future in futures]
+
+
+def fetch_all(*queries):
+    '''Return the `.all()` results of independent `queries`, in order.
+
+    The queries run concurrently when DB_FAN_OUT is on, one after another
+    otherwise.
+    '''
+    if not current_app.config['DB_FAN_OUT'] or len(queries) < 2:
+        return [query.all() for query in queries]
+    return current_app.extensions['fan_out'].all(*queries)
@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+
+#----------------------------------------------------------------------------#
+# Query plan checks.
+#
+# Replays requests through the Flask test client, records every SELECT the
+# routes issue, on the primary or a read replica, and runs EXPLAIN on it
+# where it ran. Sequential scans are disabled for the
+# EXPLAIN session so a plan only falls back to one when no index can serve
+# the query, which keeps the check meaningful on a small seeded database.
+# A scan that reads rows through an index only to discard them with a
+# Filter is reported too: it means the index does not cover the predicate.
+#----------------------------------------------------------------------------#
+
+
+@contextmanager
+def recorded_statements(engines):
+    '''Record (engine, statement, parameters) for the SELECTs run on any of `engines`.'''
+    statements = []
+
+    def recorder(engine):
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((engine, statement, parameters))
+        return before_cursor_execute
+
+    listeners = [(engine, recorder(engine)) for engine in engines]
+    for engine, listener in listeners:
+        event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        yield statements
+    finally:
+        for engine, listener in listeners:
+            event.remove(engine, 'before_cursor_execute', listener)
+
+
+def explain(engine, statement, parameters):
+    '''Return the text plan and the JSON plan tree of `statement`.'''
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SET enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        plan = [row[0] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+        tree = cursor.fetchone()[0][0]['Plan']
+        return plan, tree
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def unindexed_scans(node, tables):
+    '''Yield the tables in `tables` that `node` reads without an index.'''
+    if node.get('Relation Name') in tables:
+        if node['Node Type'] == 'Seq Scan' or 'Filter' in node:
+            yield node['Relation Name']
+    for child in node.get('Plans', ()):
+        for table in unindexed_scans(child, tables):
+            yield table
+
+
+def check_routes(app, engines, requests, tables=('Show',)):
+    '''Explain the queries issued by each (method, url, form) in `requests`.
+
+    `engines` are the primary's and every replica's. Returns a list of
+    (url, statement, plan, scanned) tuples where `scanned` lists the tables
+    from `tables` read without a usable index. A route that runs no
+    statement at all raises RuntimeError, since it would pass unchecked.
+    '''
+    if any(engine.dialect.name != 'postgresql' for engine in engines):
+        raise RuntimeError('query plan checks need a PostgreSQL database')
+    client = app.test_client()
+    results = []
+    for method, url, form in requests:
+        with recorded_statements(engines) as statements:
+            client.open(url, method=method, data=form)
+        if not statements:
+            raise RuntimeError('%s %s ran no SQL statements to check' % (method, url))
+        for engine, statement, parameters in statements:
+            plan, tree = explain(engine, statement, parameters)
+            scanned = list(unindexed_scans(tree, tables))
+            results.append((url, statement, plan, scanned))
+    return results
@@ -1,14 +1,24 @@
-from fabric.api import local, settings, abort
+import os
+
+from fabric.api import local, settings, abort, puts
 from fabric.contrib.console import confirm
 
 # prepare for deployment
 
+# machine specific, so not committed: save one with
+# "python -m benchmarks run --save benchmarks/baseline.json"
+BENCHMARK_BASELINE = "benchmarks/baseline.json"
+
 
 def test():
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local("python -m pytest -q tests", capture=True)
+        if not result.failed and os.path.exists(BENCHMARK_BASELINE):
+            result = local(
+                "python -m benchmarks run --compare {}".format(BENCHMARK_BASELINE), capture=True
+            )
+        elif not result.failed:
+            puts("No {}; skipping the benchmark comparison.".format(BENCHMARK_BASELINE))
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL, Regexp
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, TextAreaField, DateField, TimeField
+from wtforms.validators import DataRequired, AnyOf, URL, Regexp, Optional, ValidationError
 import re
 
 state_choices = [
@@ -93,6 +93,49 @@ class ShowForm(Form):
     )
 
 
+class ScheduleShowsForm(Form):
+    # CSV with a header row, as `flask import shows` takes
+    shows = TextAreaField(
+        'shows', validators=[DataRequired()],
+        default='artist_id,venue_id,start_time\n'
+    )
+
+
+class AvailabilityForm(Form):
+    city = StringField(
+        'city', validators=[DataRequired()]
+    )
+    state = SelectField(
+        'state', validators=[DataRequired()],
+        choices=state_choices
+    )
+    genre = SelectField(
+        'genre', choices=[('', 'Any genre')] + genres_choices,
+        default=''
+    )
+    first_day = DateField(
+        'first_day', validators=[DataRequired()],
+        default=lambda: datetime.today().date()
+    )
+    # defaults to first_day
+    last_day = DateField(
+        'last_day', validators=[Optional()]
+    )
+    # a slot ending at or before its start ends the next day
+    starts_at = TimeField(
+        'starts_at', validators=[DataRequired()],
+        default=datetime.min.replace(hour=18).time()
+    )
+    ends_at = TimeField(
+        'ends_at', validators=[Optional()],
+        default=datetime.min.time()
+    )
+
+    def validate_last_day(self, field):
+        if field.data and self.first_day.data and field.data < self.first_day.data:
+            raise ValidationError('The last day must not be before the first day.')
+
+
 class VenueForm(Form):
     name = StringField(
         'name', validators=[DataRequired()]
@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+import multiprocessing
+from werkzeug.datastructures import MultiDict
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#
+# Streams CSV or NDJSON records, validates each one with the same WTForms
+# form the create pages use and writes accepted rows in large batches:
+# COPY on PostgreSQL, a single executemany elsewhere. Rejected rows are
+# reported with their line number and form errors instead of aborting.
+#----------------------------------------------------------------------------#
+
+FORMATS = ('csv', 'ndjson')
+
+
+def detect_format(filename):
+    return 'ndjson' if filename.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+
+def read_records(stream, format):
+    '''Yield (line number, record dict) pairs from a CSV or NDJSON stream.'''
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            record = {'_error': str(error)}
+        yield line_number, record
+
+
+def formdata(record, list_fields=()):
+    # CSV cells carry lists as comma separated values, NDJSON as arrays
+    data = MultiDict()
+    for key, value in record.items():
+        if value is None:
+            continue
+        if key in list_fields:
+            if isinstance(value, str):
+                value = [item.strip() for item in value.split(',') if item.strip()]
+            for item in value:
+                data.add(key, item)
+        elif isinstance(value, bool):
+            data.add(key, 'y' if value else '')
+        else:
+            data.add(key, str(value))
+    return data
+
+
+class FormValidator(object):
+    '''Validate records with one reusable, CSRF-less instance of `form_class`.
+
+    Needs an application (and request) context, like any Flask-WTF form.
+    '''
+
+    def __init__(self, form_class, list_fields=()):
+        self.form = form_class(formdata=None, meta={'csrf': False})
+        self.list_fields = list_fields
+
+    def validate(self, record):
+        if '_error' in record:
+            return None, {'record': [record['_error']]}
+        form = self.form
+        form.process(formdata(record, self.list_fields))
+        if not form.validate():
+            return None, dict(form.errors)
+        return form.data, None
+
+
+_worker_validator = None
+
+
+def _start_worker(app, form_class, list_fields):
+    global _worker_validator
+    context = app.test_request_context()
+    context.push()
+    _worker_validator = FormValidator(form_class, list_fields)
+
+
+def _validate_chunk(chunk):
+    return [(line_number, record) + _worker_validator.validate(record)
+            for line_number, record in chunk]
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_records(app, records, form_class, list_fields=(), workers=1, chunk_size=1000):
+    '''Yield (line number, record, data, errors) for each record, in order.
+
+    Form validation is CPU bound, so with several `workers` the records are
+    validated in chunks by a pool of forked processes.
+    '''
+    if workers <= 1:
+        with app.test_request_context():
+            validator = FormValidator(form_class, list_fields)
+            for line_number, record in records:
+                yield (line_number, record) + validator.validate(record)
+        return
+    pool = multiprocessing.get_context('fork').Pool(
+        workers, _start_worker, (app, form_class, list_fields))
+    try:
+        for results in pool.imap(_validate_chunk, chunked(records, chunk_size)):
+            for result in results:
+                yield result
+    finally:
+        pool.terminate()
+
+
+class Resolver(object):
+    '''Map `<name>_id` or `<name>_name` references to existing primary keys.'''
+
+    def __init__(self, session, model):
+        self.session = session
+        self.model = model
+        self.ids = set()
+        self.names = {}
+
+    def prefetch(self, ids, names):
+        model = self.model
+        ids = set(reference_id for reference_id in map(self.integer, ids) if reference_id is not None) - self.ids
+        if ids:
+            self.ids.update(
+                row.id for row in self.session.query(model.id).filter(model.id.in_(ids)))
+        names = set(names) - set(self.names)
+        if names:
+            for name in names:
+                self.names[name] = None
+            matches = self.session.query(model.id, model.name).filter(
+                model.name.in_(names)).order_by(model.id)
+            for row in matches:
+                # an ambiguous name resolves to the first listed match
+                if self.names[row.name] is None:
+                    self.names[row.name] = row.id
+
+    @staticmethod
+    def integer(reference_id):
+        try:
+            return int(reference_id)
+        except (TypeError, ValueError):
+            return None
+
+    def resolve(self, reference_id, reference_name):
+        if reference_id:
+            reference_id = self.integer(reference_id)
+            return reference_id if reference_id in self.ids else None
+        return self.names.get(reference_name)
+
+
+def postgres_array(values):
+    return '{%s}' % ','.join(
+        '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"') for value in values)
+
+
+def copy_rows(connection, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            '\\N' if value is None else postgres_array(value) if isinstance(value, list) else value
+            for value in row
+        ])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        'COPY "%s" (%s) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')' % (
+            table.name, ', '.join('"%s"' % column for column in columns)),
+        buffer)
+
+
+def python_defaults(table, columns):
+    '''Return (column, value) for the Python-side defaults of the columns not in `columns`.'''
+    defaults = []
+    for column in table.columns:
+        default = column.default
+        if column.name in columns or default is None or not (default.is_scalar or default.is_callable):
+            continue
+        defaults.append((column.name, default.arg if default.is_scalar else default.arg(None)))
+    return defaults
+
+
+def write_rows(connection, table, columns, rows):
+    '''Insert `rows` (tuples in `columns` order) into `table` in one round trip.'''
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        # COPY bypasses SQLAlchemy, so its column defaults (e.g. created_at)
+        # are filled in here, once for the batch
+        defaults = python_defaults(table, columns)
+        if defaults:
+            names, values = zip(*defaults)
+            columns = tuple(columns) + names
+            rows = [tuple(row) + values for row in rows]
+        copy_rows(connection, table, columns, rows)
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
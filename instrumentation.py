@@ -0,0 +1,172 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import current_app, g, has_app_context, render_template, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# SQL instrumentation.
+#
+# Engine hooks time every statement issued while a request is being served,
+# including while a streamed response is sent. Each response carries the
+# totals in a Server-Timing header; a streamed one can only report the
+# statements run before its body started. Statements slower than
+# SLOW_QUERY_THRESHOLD_MS go to a JSON-lines slow query log, and statements
+# repeated within one request (the N+1 signature) are tallied per route,
+# next to each route's slowest statements, for the optional debug panel at
+# /_debug/queries.
+#----------------------------------------------------------------------------#
+
+
+class RequestQueries(object):
+
+    def __init__(self, endpoint, path):
+        self.endpoint = endpoint
+        self.path = path
+        self.started = time.perf_counter()
+        # statements may also run on fan-out threads carrying this record
+        self._lock = threading.Lock()
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.slowest = []
+
+    def record(self, statement, duration, keep):
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+            self.statements[statement] += 1
+            self.slowest.append((duration, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[keep:]
+
+
+class QueryReport(object):
+    '''One app's N+1 patterns and slowest statements, per route.'''
+
+    def __init__(self, slowest_statements):
+        self.slowest_statements = slowest_statements
+        self.n_plus_one = defaultdict(Counter)
+        self.slowest = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, repeated, slowest_statements):
+        with self._lock:
+            patterns = self.n_plus_one[endpoint]
+            for statement, count in repeated:
+                patterns[statement] = max(patterns[statement], count)
+            slowest = self.slowest[endpoint]
+            for duration, statement in slowest_statements:
+                slowest[statement] = max(slowest.get(statement, 0.0), duration * 1000)
+            keep = sorted(slowest.items(), key=lambda item: item[1], reverse=True)
+            self.slowest[endpoint] = dict(keep[:self.slowest_statements])
+
+    def routes(self):
+        '''Return [(endpoint, N+1 patterns, slowest statements)] per route.
+
+        Patterns are (statement, worst repeat count in one request) pairs and
+        slowest statements are (statement, worst duration in ms) pairs.
+        '''
+        with self._lock:
+            endpoints = sorted(set(self.n_plus_one) | set(self.slowest), key=str)
+            return [(endpoint,
+                     self.n_plus_one[endpoint].most_common(),
+                     sorted(self.slowest[endpoint].items(), key=lambda item: item[1], reverse=True))
+                    for endpoint in endpoints]
+
+
+class SQLInstrumentation(object):
+    '''Time the statements of each request and report them per app.
+
+    The engine hooks are registered once for the process and find the
+    request's tally in `g` and the app's QueryReport in
+    app.extensions['sql_instrumentation'], so several apps in one process
+    never count each other's statements.
+    '''
+
+    def __init__(self, app=None):
+        self.slow_query_log = logging.getLogger('fyyur.slow_queries')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 100)
+        app.config.setdefault('SLOW_QUERY_LOG', 'slow_queries.log')
+        app.config.setdefault('SQL_SLOWEST_STATEMENTS', 3)
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 3)
+        app.config.setdefault('SQL_DEBUG_PANEL', False)
+        if app.config['SLOW_QUERY_LOG'] and not self.slow_query_log.handlers:
+            handler = logging.FileHandler(app.config['SLOW_QUERY_LOG'])
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.slow_query_log.addHandler(handler)
+            self.slow_query_log.setLevel(logging.INFO)
+            self.slow_query_log.propagate = False
+
+        if not event.contains(Engine, 'before_cursor_execute', self.before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        if app.config['SQL_DEBUG_PANEL']:
+            app.add_url_rule('/_debug/queries', 'debug_queries', self.debug_panel)
+        app.extensions['sql_instrumentation'] = QueryReport(app.config['SQL_SLOWEST_STATEMENTS'])
+
+    def before_request(self):
+        g.sql_queries = RequestQueries(request.endpoint, request.full_path)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        if not has_app_context() or 'sql_queries' not in g:
+            return
+        queries = g.sql_queries
+        config = current_app.config
+        duration = time.perf_counter() - started
+        queries.record(statement, duration, config['SQL_SLOWEST_STATEMENTS'])
+        if duration * 1000 >= config['SLOW_QUERY_THRESHOLD_MS']:
+            self.slow_query_log.info(json.dumps({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'endpoint': queries.endpoint,
+                'path': queries.path,
+                'duration_ms': round(duration * 1000, 3),
+                'statement': statement
+            }))
+
+    def after_request(self, response):
+        queries = g.get('sql_queries')
+        if queries is None:
+            return response
+        total = (time.perf_counter() - queries.started) * 1000
+        # the headers go out before a streamed body, so for a streamed
+        # response they only cover the statements run before it started
+        response.headers.add('Server-Timing', 'db;dur=%.3f;desc="%d queries"' % (
+            queries.duration * 1000, queries.count))
+        response.headers.add('Server-Timing', 'app;dur=%.3f' % total)
+        app = current_app._get_current_object()
+        if response.is_streamed:
+            # statements keep being recorded while the body streams, and
+            # the route report takes them all in once the response closes
+            response.call_on_close(lambda: self.finish(app, queries))
+        else:
+            g.pop('sql_queries')
+            self.finish(app, queries)
+        return response
+
+    def finish(self, app, queries):
+        if not queries.count:
+            return
+        repeated = [(statement, count) for statement, count in queries.statements.items()
+                    if count >= app.config['N_PLUS_ONE_THRESHOLD']]
+        app.extensions['sql_instrumentation'].add(queries.endpoint, repeated, queries.slowest)
+
+    def report(self):
+        '''Return the current app's QueryReport.routes().'''
+        return current_app.extensions['sql_instrumentation'].routes()
+
+    def debug_panel(self):
+        return render_template('pages/debug_queries.html', report=self.report())
@@ -0,0 +1,427 @@
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Prometheus metrics.
+#
+# Every worker process writes its samples into its own memory-mapped file
+# under METRICS_DIR, so recording a sample takes no cross-process lock and
+# only a short per-process one. GET /metrics merges the files of all the
+# workers sharing the directory and renders the Prometheus text format:
+# counters and histograms are summed, and gauges are summed over the
+# processes that are still alive.
+#----------------------------------------------------------------------------#
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0)
+POOL_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+HEADER = struct.Struct('Q')
+KEY_LENGTH = struct.Struct('I')
+VALUE = struct.Struct('d')
+
+
+def value_offset(offset, key_length):
+    # values are kept 8-byte aligned so a reader never sees half a double
+    end = offset + KEY_LENGTH.size + key_length
+    return end + (-end % VALUE.size)
+
+
+def read_values(path):
+    '''Return the {key: value} pairs stored in a metrics file.'''
+    with open(path, 'rb') as values:
+        data = values.read()
+    if len(data) < HEADER.size:
+        return {}
+    used = HEADER.unpack_from(data, 0)[0]
+    result = {}
+    offset = HEADER.size
+    while offset < used:
+        length = KEY_LENGTH.unpack_from(data, offset)[0]
+        key = data[offset + KEY_LENGTH.size:offset + KEY_LENGTH.size + length].decode('utf-8')
+        offset = value_offset(offset, length)
+        result[key] = VALUE.unpack_from(data, offset)[0]
+        offset += VALUE.size
+    return result
+
+
+class ValueFile(object):
+    '''Float values keyed by string in a file written by a single process.
+
+    The file starts with the number of bytes in use, followed by one
+    (key length, key, padding, double) entry per key.
+    '''
+
+    def __init__(self, path, reset=False, initial_size=64 * 1024):
+        self._lock = threading.Lock()
+        self._file = open(path, 'r+b' if os.path.exists(path) and not reset else 'w+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < initial_size:
+            self._file.truncate(initial_size)
+            size = initial_size
+        self._size = size
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._used = HEADER.unpack_from(self._map, 0)[0] or HEADER.size
+        self._positions = {}
+        offset = HEADER.size
+        while offset < self._used:
+            length = KEY_LENGTH.unpack_from(self._map, offset)[0]
+            key = self._map[offset + KEY_LENGTH.size:offset + KEY_LENGTH.size + length].decode('utf-8')
+            offset = value_offset(offset, length)
+            self._positions[key] = offset
+            offset += VALUE.size
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            encoded = key.encode('utf-8')
+            position = value_offset(self._used, len(encoded))
+            end = position + VALUE.size
+            if end > self._size:
+                self._map.close()
+                self._size = max(self._size * 2, end)
+                self._file.truncate(self._size)
+                self._map = mmap.mmap(self._file.fileno(), self._size)
+            KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+            self._map[self._used + KEY_LENGTH.size:self._used + KEY_LENGTH.size + len(encoded)] = encoded
+            VALUE.pack_into(self._map, position, 0.0)
+            self._used = end
+            HEADER.pack_into(self._map, 0, end)
+            self._positions[key] = position
+        return position
+
+    def inc(self, key, amount):
+        with self._lock:
+            position = self._position(key)
+            VALUE.pack_into(self._map, position, VALUE.unpack_from(self._map, position)[0] + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            VALUE.pack_into(self._map, self._position(key), value)
+
+
+# every app in a process that records into the same directory shares its
+# files, since each ValueFile assumes it is the file's only writer
+_value_files = {}
+_value_files_lock = threading.Lock()
+
+
+def shared_value_file(path, reset=False):
+    '''Return this process's ValueFile for `path`, opening it on first use.'''
+    with _value_files_lock:
+        value_file = _value_files.get(path)
+        if value_file is None:
+            value_file = _value_files[path] = ValueFile(path, reset)
+        return value_file
+
+
+class ValueStore(object):
+    '''The current process's counter and gauge files in `directory`.
+
+    Files are opened on first use and reopened after a fork, so workers
+    forked from a preloaded app each get their own.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._files = {}
+
+    def file(self, kind):
+        pid = os.getpid()
+        if pid != self._pid:
+            with self._lock:
+                if pid != self._pid:
+                    if not os.path.isdir(self.directory):
+                        os.makedirs(self.directory, exist_ok=True)
+                    directory = os.path.abspath(self.directory)
+                    # counters survive a reused pid, gauges start over
+                    self._files = {
+                        'counter': shared_value_file(os.path.join(directory, 'counter_%d.db' % pid)),
+                        'gauge': shared_value_file(os.path.join(directory, 'gauge_%d.db' % pid), reset=True)
+                    }
+                    self._pid = pid
+        return self._files[kind]
+
+    def collect(self):
+        '''Merge the files of every process into {key: value}.'''
+        samples = {}
+        for path in glob.glob(os.path.join(self.directory, '*_*.db')):
+            kind, pid = os.path.basename(path)[:-len('.db')].split('_')
+            if kind == 'gauge' and not process_alive(int(pid)):
+                continue
+            for key, value in read_values(path).items():
+                samples[key] = samples.get(key, 0.0) + value
+        return samples
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def sample_line(name, labels, value):
+    if labels:
+        name = '%s{%s}' % (name, ','.join('%s="%s"' % (label, escape_label(label_value))
+                                          for label, label_value in labels))
+    return '%s %s' % (name, format_value(value))
+
+
+class Metric(object):
+    kind = 'counter'
+
+    def __init__(self, store, name, documentation, labelnames=()):
+        self.store = store
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}
+
+    def key(self, suffix, labels, extra=()):
+        cache_key = (suffix, labels, extra)
+        key = self._keys.get(cache_key)
+        if key is None:
+            pairs = [list(pair) for pair in zip(self.labelnames, map(str, labels))] + [list(pair) for pair in extra]
+            key = self._keys[cache_key] = json.dumps([self.name + suffix, pairs])
+        return key
+
+    def samples(self, collected):
+        '''Yield (labels, value) for this metric's samples in `collected`.'''
+        for key, value in collected.items():
+            name, labels = json.loads(key)
+            if name == self.name:
+                yield tuple(tuple(pair) for pair in labels), value
+
+    def exposition(self, collected):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        for labels, value in sorted(self.samples(collected)):
+            lines.append(sample_line(self.name, labels, value))
+        return lines
+
+
+class Counter(Metric):
+
+    def inc(self, labels=(), amount=1):
+        self.store.file('counter').inc(self.key('', labels), amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        self.store.file('gauge').inc(self.key('', labels), amount)
+
+    def dec(self, labels=(), amount=1):
+        self.store.file('gauge').inc(self.key('', labels), -amount)
+
+    def set(self, labels=(), value=0):
+        self.store.file('gauge').set(self.key('', labels), value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, store, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(store, name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.bucket_labels = [format_value(bound) for bound in self.buckets]
+
+    def observe(self, value, labels=()):
+        # buckets are stored non-cumulative and summed up when collected
+        values = self.store.file('counter')
+        bucket = self.bucket_labels[bisect.bisect_left(self.buckets, value)]
+        values.inc(self.key('_bucket', labels, (('le', bucket),)), 1)
+        values.inc(self.key('_sum', labels), value)
+
+    def exposition(self, collected):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        series = {}
+        for key, value in collected.items():
+            name, labels = json.loads(key)
+            if name == self.name + '_bucket':
+                labels = tuple(tuple(pair) for pair in labels)
+                series.setdefault(labels[:-1], {})[labels[-1][1]] = value
+            elif name == self.name + '_sum':
+                series.setdefault(tuple(tuple(pair) for pair in labels), {})['sum'] = value
+        for labels, values in sorted(series.items()):
+            cumulative = 0.0
+            for bound in self.bucket_labels:
+                cumulative += values.get(bound, 0.0)
+                lines.append(sample_line(self.name + '_bucket', labels + (('le', bound),), cumulative))
+            lines.append(sample_line(self.name + '_sum', labels, values.get('sum', 0.0)))
+            lines.append(sample_line(self.name + '_count', labels, cumulative))
+        return lines
+
+
+class MetricsRegistry(object):
+    '''One app's metrics, recorded into the value files under `directory`.'''
+
+    def __init__(self, directory):
+        self.store = ValueStore(directory)
+        self.metrics = []
+        self.requests = self.counter(
+            'fyyur_http_requests_total', 'HTTP requests served.', ('endpoint', 'method', 'status'))
+        self.request_duration = self.histogram(
+            'fyyur_http_request_duration_seconds', 'Time spent serving HTTP requests.',
+            ('endpoint', 'method'))
+        self.in_progress = self.gauge(
+            'fyyur_http_requests_in_progress', 'HTTP requests being served.', ('endpoint',))
+        self.pool_wait = self.histogram(
+            'fyyur_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled database connection.',
+            buckets=POOL_BUCKETS)
+        self.cache_requests = self.counter(
+            'fyyur_cache_requests_total', 'Cache lookups by result.', ('cache', 'result'))
+        self.template_duration = self.histogram(
+            'fyyur_template_render_seconds', 'Time spent rendering templates.', ('template',))
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(self.store, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(self.store, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(self.store, name, documentation, labelnames, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        collected = self.store.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.exposition(collected))
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics(object):
+    '''Record each app's requests, pool waits, cache lookups and template renders.
+
+    Every app keeps its own MetricsRegistry in app.extensions['metrics'],
+    so several apps in one process (the tests, the benchmarks) never record
+    into each other's series.
+    '''
+
+    def __init__(self, app=None):
+        self._pools = weakref.WeakSet()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_DIR', 'metrics')
+        registry = app.extensions['metrics'] = MetricsRegistry(app.config['METRICS_DIR'])
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        # one class-level listener serves every app in the process
+        if not event.contains(Engine, 'engine_connect', self.engine_connect):
+            event.listen(Engine, 'engine_connect', self.engine_connect)
+        self.instrument_templates(app, registry)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def before_request(self):
+        g.metrics_endpoint = request.endpoint or 'unmatched'
+        g.metrics_started = time.perf_counter()
+        current_app.extensions['metrics'].in_progress.inc((g.metrics_endpoint,))
+
+    def after_request(self, response):
+        if 'metrics_started' in g:
+            registry = current_app.extensions['metrics']
+            registry.request_duration.observe(
+                time.perf_counter() - g.metrics_started, (g.metrics_endpoint, request.method))
+            registry.requests.inc((g.metrics_endpoint, request.method, response.status_code))
+        return response
+
+    def teardown_request(self, exception):
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            current_app.extensions['metrics'].in_progress.dec((endpoint,))
+
+    def engine_connect(self, connection, branch):
+        # an engine belongs to one app, whose context is current when it is
+        # first used for a request or command
+        pool = connection.engine.pool
+        if pool not in self._pools and has_app_context() and 'metrics' in current_app.extensions:
+            self.instrument_pool(pool, current_app.extensions['metrics'])
+
+    def instrument_pool(self, pool, registry):
+        # the pool has no "checkout started" event, so time its getter
+        do_get = pool._do_get
+        pool_wait = registry.pool_wait
+
+        def timed_do_get():
+            started = time.perf_counter()
+            try:
+                return do_get()
+            finally:
+                pool_wait.observe(time.perf_counter() - started)
+        pool._do_get = timed_do_get
+        self._pools.add(pool)
+
+    def instrument_cache(self, app, cache, name):
+        cache_requests = app.extensions['metrics'].cache_requests
+        cache.on_lookup = lambda hit: cache_requests.inc((name, 'hit' if hit else 'miss'))
+
+    def instrument_templates(self, app, registry):
+        base = app.jinja_env.template_class
+        template_duration = registry.template_duration
+
+        class TimedTemplate(base):
+
+            def render(self, *args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return base.render(self, *args, **kwargs)
+                finally:
+                    template_duration.observe(time.perf_counter() - started, (self.name or '<string>',))
+
+            def generate(self, *args, **kwargs):
+                # a streamed page only counts the time spent rendering it,
+                # not the time the client takes to read each chunk
+                elapsed = 0.0
+                chunks = base.generate(self, *args, **kwargs)
+                try:
+                    while True:
+                        started = time.perf_counter()
+                        try:
+                            chunk = next(chunks)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += time.perf_counter() - started
+                        yield chunk
+                finally:
+                    chunks.close()
+                    template_duration.observe(elapsed, (self.name or '<string>',))
+        app.jinja_env.template_class = TimedTemplate
+
+    def metrics_view(self):
+        return Response(current_app.extensions['metrics'].exposition(), mimetype=None, content_type=CONTENT_TYPE)
@@ -0,0 +1,42 @@
+"""empty message
+
+Revision ID: 3f1c9a7e2b54
+Revises: db9008d9bfc0
+Create Date: 2020-06-02 14:21:37.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7e2b54'
+down_revision = 'db9008d9bfc0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Artist', sa.Column('search_document', sa.Text(), nullable=True))
+    op.add_column('Venue', sa.Column('search_document', sa.Text(), nullable=True))
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for table, index in (('Venue', 'venue_search'), ('Artist', 'artist_search')):
+        op.execute(
+            "UPDATE \"{table}\" SET search_document = concat_ws(' ', name, city, state, "
+            "array_to_string(genres, ' '))".format(table=table))
+        op.execute(
+            "CREATE INDEX ix_{index}_tsv ON \"{table}\" USING gin "
+            "(to_tsvector('simple'::regconfig, coalesce(search_document, '')))".format(index=index, table=table))
+        op.execute(
+            "CREATE INDEX ix_{index}_trgm ON \"{table}\" USING gin "
+            "(search_document gin_trgm_ops)".format(index=index, table=table))
+
+
+def downgrade():
+    op.drop_index('ix_artist_search_trgm', table_name='Artist')
+    op.drop_index('ix_artist_search_tsv', table_name='Artist')
+    op.drop_index('ix_venue_search_trgm', table_name='Venue')
+    op.drop_index('ix_venue_search_tsv', table_name='Venue')
+    op.drop_column('Venue', 'search_document')
+    op.drop_column('Artist', 'search_document')
@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+#----------------------------------------------------------------------------#
+# Keyset pagination.
+#
+# Pages are addressed by the sort key of a boundary row instead of an
+# OFFSET, so the database seeks straight to the page through the index on
+# the sort columns and page 10,000 costs the same as page one.
+#----------------------------------------------------------------------------#
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page(object):
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def toDict(self, serialize):
+        return {
+            'data': list(map(serialize, self.items)),
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor
+        }
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(key, direction):
+    payload = json.dumps([direction, list(map(_dump_value, key))], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, key_length):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        key = tuple(map(_load_value, key))
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+    if direction not in ('next', 'prev') or len(key) != key_length:
+        raise InvalidCursor(cursor)
+    return direction, key
+
+
+def paginate(query, order_by, cursor=None, per_page=50):
+    '''Return one Page of `query` ordered by the `order_by` columns.
+
+    The last column must be unique (normally the primary key) so every row
+    has a distinct position, and none may be NULL: a row compares neither
+    before nor after a NULL key, so it would drop out of every later page. Rows returned by `query` must expose each
+    ordering column under its key, e.g. `Show.start_time` as `start_time`.
+    '''
+    keys = [column.key for column in order_by]
+    direction, boundary = 'next', None
+    if cursor:
+        direction, boundary = decode_cursor(cursor, len(order_by))
+
+    if direction == 'next':
+        if boundary is not None:
+            query = query.filter(tuple_(*order_by) > boundary)
+        query = query.order_by(*order_by)
+    else:
+        query = query.filter(tuple_(*order_by) < boundary)
+        query = query.order_by(*[column.desc() for column in order_by])
+
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'prev':
+        items.reverse()
+    if not items:
+        return Page(items)
+
+    def key_of(row):
+        return [getattr(row, key) for key in keys]
+
+    first_cursor = encode_cursor(key_of(items[0]), 'prev')
+    last_cursor = encode_cursor(key_of(items[-1]), 'next')
+    if direction == 'next':
+        return Page(items,
+                    next_cursor=last_cursor if has_more else None,
+                    prev_cursor=first_cursor if boundary is not None else None)
+    return Page(items,
+                next_cursor=last_cursor,
+                prev_cursor=first_cursor if has_more else None)
@@ -0,0 +1,101 @@
+import re
+from sqlalchemy import DDL, event, false, func, literal_column, or_
+from sqlalchemy.sql import column, table
+
+#----------------------------------------------------------------------------#
+# Full-text search.
+#
+# Each searchable model keeps a denormalized `search_document` column
+# (name, city, state and genres). PostgreSQL indexes it twice with GIN: a
+# `simple` tsvector for ranked word/prefix matches and pg_trgm trigrams so
+# substring ILIKE lookups stay index scans. SQLite mirrors the column into
+# an FTS5 table kept in sync by triggers, for local development and tests.
+#----------------------------------------------------------------------------#
+
+TS_CONFIG = literal_column("'simple'::regconfig")
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def search_document(*parts):
+    words = []
+    for part in parts:
+        if isinstance(part, (list, tuple)):
+            words.extend(p for p in part if p)
+        elif part:
+            words.append(part)
+    return ' '.join(words)
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class SearchIndex(object):
+
+    def __init__(self, model, name):
+        self.model = model
+        self.name = name
+        self._install_ddl()
+
+    def _install_ddl(self):
+        model_table = self.model.__table__
+        quoted = '"%s"' % model_table.name
+        postgresql = [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            'CREATE INDEX IF NOT EXISTS ix_%s_tsv ON %s USING gin '
+            "(to_tsvector('simple'::regconfig, coalesce(search_document, '')))" % (self.name, quoted),
+            'CREATE INDEX IF NOT EXISTS ix_%s_trgm ON %s USING gin '
+            '(search_document gin_trgm_ops)' % (self.name, quoted),
+        ]
+        sqlite = [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5"
+            "(search_document, content={table}, content_rowid='id')",
+            "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END",
+            "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+            "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+            "INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END",
+        ]
+        for statement in postgresql:
+            event.listen(model_table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+        for statement in sqlite:
+            statement = statement.format(fts=self.name, table=quoted)
+            event.listen(model_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+        event.listen(model_table, 'before_drop',
+                     DDL('DROP TABLE IF EXISTS %s' % self.name).execute_if(dialect='sqlite'))
+
+    def search(self, query, term, limit):
+        '''Filter and rank `query` (over the indexed model) by `term`.'''
+        term = term.strip()
+        if not term:
+            return query.order_by(self.model.name, self.model.id).limit(limit)
+        dialect = query.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            return self._search_sqlite(query, term, limit)
+        return self._search_postgresql(query, term, limit)
+
+    def _search_postgresql(self, query, term, limit):
+        model = self.model
+        # same expressions as the GIN indexes, so the planner can use them
+        document = func.coalesce(model.search_document, '')
+        match = model.search_document.ilike('%' + escape_like(term) + '%', escape='\\')
+        rank = func.similarity(model.name, term)
+        words = WORD.findall(term)
+        if words:
+            vector = func.to_tsvector(TS_CONFIG, document)
+            tsquery = func.to_tsquery(TS_CONFIG, ' & '.join(word + ':*' for word in words))
+            match = or_(vector.op('@@')(tsquery), match)
+            rank = rank + func.ts_rank_cd(vector, tsquery)
+        return query.filter(match).order_by(rank.desc(), model.id).limit(limit)
+
+    def _search_sqlite(self, query, term, limit):
+        words = WORD.findall(term)
+        if not words:
+            return query.filter(false())
+        fts = table(self.name, column('rowid'), column('rank'))
+        fts_query = ' '.join('"%s"*' % word for word in words)
+        return query.join(fts, fts.c.rowid == self.model.id).filter(
+            literal_column(self.name).op('MATCH')(fts_query)
+        ).order_by(fts.c.rank, self.model.id).limit(limit)
@@ -0,0 +1,94 @@
+import json
+from datetime import date, datetime
+from json.encoder import encode_basestring_ascii
+from flask import Response, current_app, stream_with_context
+
+#----------------------------------------------------------------------------#
+# Streaming JSON serialization.
+#
+# Rows come straight from a server-side cursor and are written with a
+# per-query template, so exporting a large table never materializes the
+# result set nor builds a dict per row before encoding it.
+#----------------------------------------------------------------------------#
+
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def json_value(value):
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, (datetime, date)):
+        return '"%s"' % value.isoformat()
+    return json.dumps(value, separators=(',', ':'))
+
+
+def row_encoder(fields):
+    '''Return a function encoding a row tuple as a JSON object of `fields`.'''
+    template = '{%s}' % ','.join(
+        '%s:%%s' % encode_basestring_ascii(field).replace('%', '%%') for field in fields)
+
+    def encode(row):
+        return template % tuple(map(json_value, row))
+    return encode
+
+
+def stream_rows(rows, encode, format='json', batch_size=500):
+    '''Yield `rows` encoded as a JSON array or NDJSON, in batches.'''
+    batch = []
+    if format == 'ndjson':
+        for row in rows:
+            batch.append(encode(row))
+            if len(batch) >= batch_size:
+                yield '\n'.join(batch) + '\n'
+                batch = []
+        if batch:
+            yield '\n'.join(batch) + '\n'
+        return
+
+    separator = '['
+    for row in rows:
+        batch.append(encode(row))
+        if len(batch) >= batch_size:
+            yield separator + ','.join(batch)
+            separator, batch = ',', []
+    if batch:
+        yield separator + ','.join(batch)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+#----------------------------------------------------------------------------#
+# Streaming HTML.
+#----------------------------------------------------------------------------#
+
+def buffered(chunks, size):
+    '''Join the small strings a template yields into chunks of about `size`.'''
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_template(template_name, **context):
+    '''Like render_template, but send the page while it is being rendered.'''
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_or_select_template(template_name)
+    chunks = buffered(template.generate(context), app.config['HTML_STREAM_BUFFER_SIZE'])
+    return Response(stream_with_context(chunks), mimetype='text/html')
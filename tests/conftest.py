@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import event
+
+import app as fyyur
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = fyyur.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % tmp_path.joinpath('fyyur.db'),
+        'SQLALCHEMY_REPLICA_URIS': [],
+        'CACHE_TYPE': 'lru',
+        'TEMPLATE_CACHE_DIR': str(tmp_path.joinpath('jinja')),
+        'THUMBNAIL_DIR': str(tmp_path.joinpath('thumbnails')),
+        'METRICS_DIR': str(tmp_path.joinpath('metrics')),
+        'SLOW_QUERY_LOG': str(tmp_path.joinpath('slow_queries.log')),
+        'WTF_CSRF_ENABLED': False,
+    })
+    with app.app_context():
+        fyyur.db.create_all()
+        yield app
+        fyyur.db.session.remove()
+        fyyur.db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(app):
+    '''The SQL statements the app runs, recorded until the test ends.'''
+    recorded = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.append(statement)
+
+    engine = fyyur.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield recorded
+    event.remove(engine, 'before_cursor_execute', record)
+
@@ -0,0 +1,23 @@
+import app as fyyur
+
+
+def add_venue(name='The Musical Hop', city='San Francisco', state='CA', genres=('Jazz',)):
+    venue = fyyur.Venue(name, city, state, '1015 Folsom Street', '123-123-1234', None, list(genres),
+                        None, None)
+    fyyur.db.session.add(venue)
+    fyyur.db.session.commit()
+    return venue
+
+
+def add_artist(name='Guns N Petals', city='San Francisco', state='CA', genres=('Rock n Roll',)):
+    artist = fyyur.Artist(name, city, state, '326-123-5000', list(genres), None, None, None)
+    fyyur.db.session.add(artist)
+    fyyur.db.session.commit()
+    return artist
+
+
+def add_show(venue, artist, start_time):
+    show = fyyur.Show(venue.id, artist.id, start_time)
+    fyyur.db.session.add(show)
+    fyyur.db.session.commit()
+    return show
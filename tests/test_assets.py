@@ -0,0 +1,24 @@
+import os
+from urllib.parse import urljoin
+
+from assets import BUNDLES, CSS_URL, build_assets
+
+
+def linked_urls(base, css):
+    return set(urljoin(base, url) for _, url in CSS_URL.findall(css))
+
+
+def test_bundled_stylesheet_links_the_same_files(app, client, tmp_path):
+    assets_dir = str(tmp_path.joinpath('dist'))
+    manifest = build_assets(app.static_folder, assets_dir, static_url_path=app.static_url_path)
+    app.config['ASSETS_DIR'] = assets_dir
+    expected = set()
+    for source in BUNDLES['main.css']:
+        with open(os.path.join(app.static_folder, source), encoding='utf-8') as source_file:
+            expected |= linked_urls('/static/' + source, source_file.read())
+    assert expected
+
+    path = '/assets/' + manifest['main.css']
+    response = client.get(path)
+    assert response.status_code == 200
+    assert linked_urls(path, response.get_data(as_text=True)) == expected
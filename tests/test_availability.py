@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytest
+
+import app as fyyur
+from tests.factories import add_artist, add_show, add_venue
+
+DAY = fyyur.DAY_SECONDS
+HOUR = 3600
+# an 18:00 to midnight slot, shows of three hours
+SLOT, SHOW = 6 * HOUR, 3 * HOUR
+
+
+@pytest.mark.parametrize('offset, days, slot_length, show_length, bitmap', [
+    (0, 3, SLOT, SHOW, 0b001),
+    (2 * DAY, 3, SLOT, SHOW, 0b100),
+    # ends as the slot starts
+    (-SHOW, 3, SLOT, SHOW, 0),
+    (-SHOW + 1, 3, SLOT, SHOW, 0b001),
+    # starts as the slot ends
+    (SLOT, 3, SLOT, SHOW, 0),
+    # runs past midnight, but ends before the next day's slot
+    (SLOT - 60, 3, SLOT, SHOW, 0b001),
+    # before and after the searched days
+    (-DAY, 3, SLOT, SHOW, 0),
+    (5 * DAY, 3, SLOT, SHOW, 0),
+    (DAY, 5, SLOT, 3 * DAY, 0b01110),
+    # a slot ending at 06:00 the next morning
+    (DAY - 13 * HOUR, 3, 12 * HOUR, SHOW, 0b001),
+    (DAY - HOUR, 3, 12 * HOUR, SHOW, 0b010),
+])
+def test_busy_days(offset, days, slot_length, show_length, bitmap):
+    assert fyyur.busy_days(offset, days, slot_length, show_length) == bitmap
+
+
+def test_availability_lists_free_days(app, client):
+    busy, free = add_venue('The Musical Hop'), add_venue('The Dueling Pianos Bar')
+    add_venue('Park Square Live Music & Coffee', city='New York', state='NY')
+    artist = add_artist()
+    add_show(busy, artist, datetime(2030, 5, 1, 20, 0))
+    add_show(busy, artist, datetime(2030, 5, 3, 16, 0))
+    response = client.get('/api/v1/venues/availability?city=San+Francisco&state=CA'
+                          '&first_day=2030-05-01&last_day=2030-05-03&starts_at=18:00&ends_at=00:00')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['count'] == 2
+    assert body['data'] == [
+        {'id': free.id, 'name': free.name, 'free_days': ['2030-05-01', '2030-05-02', '2030-05-03']},
+        {'id': busy.id, 'name': busy.name, 'free_days': ['2030-05-02']},
+    ]
+
+
+def test_availability_matches_the_city_in_any_case(app, client):
+    venue = add_venue()
+    response = client.get('/api/v1/venues/availability?city=san+FRANCISCO&state=CA&first_day=2030-05-01')
+    assert response.status_code == 200
+    assert [row['id'] for row in response.get_json()['data']] == [venue.id]
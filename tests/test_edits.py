@@ -0,0 +1,48 @@
+import pytest
+
+import app as fyyur
+from tests.factories import add_artist, add_venue
+
+
+def edit_form(kind, model, **values):
+    form = {'name': model.name, 'city': model.city, 'state': model.state, 'phone': model.phone,
+            'genres': model.genres, 'facebook_link': '', 'image_link': '', 'website': '',
+            'seeking_description': '', 'version': str(model.version)}
+    if kind == 'venues':
+        form['address'] = model.address
+    form.update(values)
+    return form
+
+
+@pytest.mark.parametrize('kind, add', [('venues', add_venue), ('artists', add_artist)])
+def test_edit_from_a_stale_form_is_refused(app, client, kind, add):
+    model = add()
+    model_class, model_id = type(model), model.id
+    path = '/%s/%d/edit' % (kind, model_id)
+    assert 'name="version" value="%d"' % model.version in client.get(path).get_data(as_text=True)
+    stale = edit_form(kind, model, name='Renamed')
+    assert client.post(path, data=edit_form(kind, model, name='Edited')).status_code == 302
+
+    response = client.post(path, data=stale)
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(path)
+    with client.session_transaction() as session:
+        assert 'modified by someone else' in session['_flashes'][-1][1]
+    assert model_class.query.get(model_id).name == 'Edited'
+
+
+def test_edit_racing_another_edit_is_refused(app, client, monkeypatch):
+    venue = add_venue()
+    venue_id, form = venue.id, edit_form('venues', venue, name='Renamed')
+    table = fyyur.Venue.__table__
+
+    def edited_meanwhile(model):
+        # another request saves between this one's load and its flush; on
+        # SQLite it shares the transaction the refused edit rolls back
+        fyyur.db.session.execute(table.update().values(name='Edited', version=table.c.version + 1))
+    monkeypatch.setattr(fyyur, 'check_version', edited_meanwhile)
+    response = client.post('/venues/%d/edit' % venue_id, data=form)
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert 'modified by someone else' in session['_flashes'][-1][1]
+    assert fyyur.Venue.query.get(venue_id).name != 'Renamed'
@@ -0,0 +1,49 @@
+from sqlalchemy import select
+
+import app as fyyur
+from tests.factories import add_artist, add_venue
+
+
+def test_genre_deltas():
+    assert fyyur.genre_deltas() == {}
+    assert fyyur.genre_deltas(added=[['Jazz', 'Blues'], ['Jazz']]) == {'Jazz': 2, 'Blues': 1}
+    # a genre listed twice still counts the row once
+    assert fyyur.genre_deltas(added=[['Jazz', 'Jazz']]) == {'Jazz': 1}
+    assert fyyur.genre_deltas(added=[None, []], removed=[None]) == {}
+    # an edit from Jazz, Blues to Jazz, Folk
+    assert fyyur.genre_deltas(added=[['Jazz', 'Folk']], removed=[['Jazz', 'Blues']]) == {
+        'Jazz': 0, 'Folk': 1, 'Blues': -1}
+
+
+def genre_counts():
+    table = fyyur.GenreCount.__table__
+    return dict((row.genre, (row.venue_count, row.artist_count))
+                for row in fyyur.db.session.execute(select([table])) if row.venue_count or row.artist_count)
+
+
+def test_genre_counts_follow_inserts_edits_and_deletes(app):
+    venue = add_venue(genres=('Jazz', 'Blues'))
+    add_venue('The Dueling Pianos Bar', genres=('Jazz',))
+    add_artist(genres=('Jazz', 'Rock n Roll'))
+    assert genre_counts() == {'Jazz': (2, 1), 'Blues': (1, 0), 'Rock n Roll': (0, 1)}
+
+    venue.genres = ['Jazz', 'Folk']
+    fyyur.db.session.commit()
+    assert genre_counts() == {'Jazz': (2, 1), 'Folk': (1, 0), 'Rock n Roll': (0, 1)}
+
+    fyyur.db.session.delete(venue)
+    fyyur.db.session.commit()
+    assert genre_counts() == {'Jazz': (1, 1), 'Rock n Roll': (0, 1)}
+
+    counts = genre_counts()
+    assert fyyur.rebuild_genre_counts(fyyur.db.session.connection()) == 2
+    assert genre_counts() == counts
+
+
+def test_listings_filter_by_genre(app, client):
+    add_venue(genres=('Jazz',))
+    add_venue('The Dueling Pianos Bar', genres=('Classical', 'R&B'))
+    jazz = client.get('/venues?genre=Jazz').data
+    assert b'The Musical Hop' in jazz
+    assert b'The Dueling Pianos Bar' not in jazz
+    assert b'The Dueling Pianos Bar' in client.get('/venues?genre=R%26B').data
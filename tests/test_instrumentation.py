@@ -0,0 +1,69 @@
+import re
+import threading
+
+from sqlalchemy import event
+
+import app as fyyur
+from tests.factories import add_venue
+
+
+def server_timing_count(response):
+    return int(re.search(r'desc="(\d+) queries"', ', '.join(response.headers.getlist('Server-Timing'))).group(1))
+
+
+def test_second_app_does_not_double_count(app, client, statements, tmp_path):
+    other = fyyur.create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'TEMPLATE_CACHE_DIR': str(tmp_path.joinpath('other_jinja')),
+        'THUMBNAIL_DIR': str(tmp_path.joinpath('other_thumbnails')),
+        'METRICS_DIR': str(tmp_path.joinpath('other_metrics')),
+    })
+    add_venue()
+    del statements[:]
+    response = client.get('/artists')
+    assert server_timing_count(response) == len(statements) > 0
+
+    # the request is recorded by its own app's metrics only
+    assert 'endpoint="artists"' in app.extensions['metrics'].exposition()
+    assert 'endpoint="artists"' not in other.extensions['metrics'].exposition()
+
+
+def test_streamed_statements_reach_the_route_report(app, client, statements):
+    for number in range(3):
+        add_venue('Venue %d' % number)
+    del statements[:]
+    response = client.get('/api/v1/venues/export')
+    assert len(response.get_json()) == 3
+    response.close()
+
+    # the export query runs once the body starts streaming, after the
+    # Server-Timing header has gone out
+    assert any('FROM "Venue"' in statement for statement in statements)
+    assert server_timing_count(response) == 0
+    report = dict((endpoint, slowest) for endpoint, _, slowest in app.extensions['sql_instrumentation'].routes())
+    assert any('FROM "Venue"' in statement for statement, _ in report['api_export_venues'])
+
+
+def test_fanned_out_statements_count_towards_the_request(app, client, statements):
+    path = '/venues/%d' % add_venue().id
+    app.config['DB_FAN_OUT'] = True
+    threads = set()
+    event.listen(fyyur.db.engine, 'before_cursor_execute', lambda *args: threads.add(threading.get_ident()))
+    del statements[:]
+    response = client.get(path)
+    assert response.status_code == 200
+    assert len(threads) > 1
+    assert server_timing_count(response) == len(statements) > 0
+
+
+def test_apps_sharing_a_metrics_directory(app):
+    other = fyyur.create_app(dict(app.config))
+    clients = [app.test_client(), other.test_client()]
+    # interleaved, so each app records series the other has not seen yet
+    for path in ('/venues', '/artists', '/shows'):
+        for client in clients:
+            client.get(path)
+
+    exposition = clients[1].get('/metrics').get_data(as_text=True)
+    for endpoint in ('venues', 'artists', 'shows'):
+        assert 'fyyur_http_requests_total{endpoint="%s",method="GET",status="200"} 2.0' % endpoint in exposition
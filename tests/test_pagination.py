@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+import app as fyyur
+from pagination import InvalidCursor, decode_cursor, encode_cursor, paginate
+from tests.factories import add_artist
+
+
+def walk(query, order_by, per_page, direction='next'):
+    '''Return the pages of `query` following next cursors from the first page, or with
+    'prev', following prev cursors back from the last page.'''
+    page = paginate(query, order_by, per_page=per_page)
+    pages = [page]
+    while page.next_cursor:
+        page = paginate(query, order_by, page.next_cursor, per_page)
+        pages.append(page)
+    if direction == 'prev':
+        pages = [page]
+        while page.prev_cursor:
+            page = paginate(query, order_by, page.prev_cursor, per_page)
+            pages.append(page)
+    return pages
+
+
+def test_cursor_round_trip():
+    key = ['Jazz Club', datetime(2020, 6, 1, 20, 30), 7]
+    assert decode_cursor(encode_cursor(key, 'prev'), 3) == ('prev', tuple(key))
+
+
+@pytest.mark.parametrize('cursor', ['', 'not base64!', encode_cursor([1], 'sideways'), encode_cursor([1, 2], 'next')])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, 1)
+
+
+def test_pages_cover_every_row_once(app):
+    # equal names make the id tie-breaker matter
+    for number in range(7):
+        add_artist('Artist %d' % (number // 2))
+    query = fyyur.artist_listing_query()
+    expected = [row.id for row in query.order_by(*fyyur.artist_listing_order)]
+
+    pages = walk(query, fyyur.artist_listing_order, 3)
+    assert [len(page.items) for page in pages] == [3, 3, 1]
+    assert [row.id for page in pages for row in page.items] == expected
+    assert pages[0].prev_cursor is None and pages[-1].next_cursor is None
+
+    # walking back from the last page visits the same pages in reverse
+    back = walk(query, fyyur.artist_listing_order, 3, 'prev')
+    assert [[row.id for row in page.items] for page in back] == [
+        [row.id for row in page.items] for page in reversed(pages)]
+
+
+def test_empty_query(app):
+    page = paginate(fyyur.artist_listing_query(), fyyur.artist_listing_order, per_page=3)
+    assert page.items == [] and page.next_cursor is None and page.prev_cursor is None
+
+
+def test_bad_cursor_is_a_400(client):
+    assert client.get('/artists?cursor=garbage').status_code == 400
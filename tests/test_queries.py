@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from tests.factories import add_artist, add_show, add_venue
+
+
+def add_catalog(size):
+    '''Add `size` venues and artists, each with a past and an upcoming show.'''
+    now = datetime.now()
+    for number in range(size):
+        venue = add_venue('Venue %d' % number, city='City %d' % (number % 2))
+        artist = add_artist('Artist %d' % number)
+        add_show(venue, artist, now - timedelta(days=number + 1))
+        add_show(venue, artist, now + timedelta(days=number + 1))
+
+
+def statement_count(app, client, statements, path):
+    app.extensions['detail_cache'].clear()
+    app.extensions['fragment_cache'].clear()
+    del statements[:]
+    response = client.get(path)
+    assert response.status_code == 200
+    response.get_data()
+    return len(statements)
+
+
+@pytest.mark.parametrize('path', ['/venues', '/artists', '/shows', '/venues/1', '/artists/1'])
+def test_statement_count_does_not_grow_with_rows(app, client, statements, path):
+    add_catalog(3)
+    small = statement_count(app, client, statements, path)
+    add_catalog(6)
+    assert statement_count(app, client, statements, path) == small
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import app as fyyur
+from tests.factories import add_artist, add_show, add_venue
+
+LENGTH = timedelta(hours=3)
+NOON = datetime(2030, 5, 1, 12, 0)
+
+
+def test_clashing_show():
+    times = [NOON, NOON + timedelta(hours=6)]
+    assert fyyur.clashing_show([], NOON, LENGTH) is None
+    assert fyyur.clashing_show(times, NOON, LENGTH) == NOON
+    assert fyyur.clashing_show(times, NOON + timedelta(hours=2), LENGTH) == NOON
+    assert fyyur.clashing_show(times, NOON + timedelta(hours=4), LENGTH) == NOON + timedelta(hours=6)
+    # shows may follow each other back to back
+    assert fyyur.clashing_show(times, NOON + timedelta(hours=3), LENGTH) is None
+    assert fyyur.clashing_show(times, NOON - LENGTH, LENGTH) is None
+
+
+def show_record(venue, artist, start_time):
+    return {'venue_id': venue.id, 'artist_id': artist.id, 'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def test_schedule_rejects_double_bookings(app, client):
+    venue, artist = add_venue(), add_artist()
+    other_venue, other_artist = add_venue('The Dueling Pianos Bar'), add_artist('Matt Quevedo')
+    add_show(venue, artist, NOON)
+    response = client.post('/api/v1/shows/batch', json=[
+        # the venue is booked
+        show_record(venue, other_artist, NOON + timedelta(hours=1)),
+        # the artist is booked
+        show_record(other_venue, artist, NOON - timedelta(hours=1)),
+        show_record(other_venue, other_artist, NOON + timedelta(hours=3)),
+        # clashes with the show before it in the batch
+        show_record(other_venue, other_artist, NOON + timedelta(hours=4)),
+        {'venue_id': 999, 'artist_id': other_artist.id, 'start_time': '2030-06-01 20:00:00'},
+    ])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['scheduled'] == [2]
+    rejected = dict((row['index'], row['errors']) for row in body['rejected'])
+    assert sorted(rejected) == [0, 1, 3, 4]
+    assert list(rejected[0]) == ['venue_id']
+    assert list(rejected[1]) == ['artist_id']
+    assert sorted(rejected[3]) == ['artist_id', 'venue_id']
+    assert rejected[4] == {'venue_id': ['Unknown reference']}
+    assert fyyur.Show.query.count() == 2
+
+
+def test_schedule_error_rolls_back(app, client, monkeypatch):
+    venue, artist = add_venue(), add_artist()
+
+    def fail(connection, shows):
+        fyyur.write_rows(connection, fyyur.Show.__table__, ('artist_id', 'venue_id', 'start_time'),
+                         [(show[1], show[0], show[2]) for show in shows])
+        raise RuntimeError('lost the connection')
+    monkeypatch.setattr(fyyur, 'schedule_shows', fail)
+    response = client.post('/api/v1/shows/batch', json=[show_record(venue, artist, NOON)])
+    assert response.status_code == 500
+    assert 'error' in response.get_json()
+    assert fyyur.Show.query.count() == 0
+
+
+def test_import_rejects_double_bookings(app, tmp_path):
+    venue, artist = add_venue(), add_artist()
+    add_show(venue, artist, NOON)
+    source = tmp_path.joinpath('shows.csv')
+    source.write_text('venue_id,artist_id,start_time\n'
+                      '%(venue)d,%(artist)d,2030-05-01 13:00:00\n'
+                      '%(venue)d,%(artist)d,2030-05-01 18:00:00\n'
+                      '%(venue)d,%(artist)d,2030-05-01 19:00:00\n' % {'venue': venue.id, 'artist': artist.id})
+    result = app.test_cli_runner().invoke(args=['import', 'shows', str(source), '--workers', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Imported 1 shows, rejected 2' in result.output
+    assert fyyur.Show.query.count() == 2
+    assert list(fyyur.stale_show_counts(fyyur.db.session.connection())) == []
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from sqlalchemy import select
+
+import app as fyyur
+from tests.factories import add_artist, add_show, add_venue
+
+
+def counts(model, row_id):
+    row = fyyur.db.session.execute(
+        select([model.upcoming_shows_count, model.past_shows_count]).where(model.id == row_id)).first()
+    return tuple(row)
+
+
+def rolled_over_at():
+    return fyyur.show_counter_rollover_time(fyyur.db.session.connection())
+
+
+def test_shows_count_against_the_rollover_time(app):
+    venue, artist = add_venue(), add_artist()
+    now = rolled_over_at()
+    add_show(venue, artist, now + timedelta(days=1))
+    add_show(venue, artist, now + timedelta(days=2))
+    add_show(venue, artist, now - timedelta(days=1))
+    assert counts(fyyur.Venue, venue.id) == (2, 1)
+    assert counts(fyyur.Artist, artist.id) == (2, 1)
+
+
+def test_deleting_a_show_uncounts_it(app):
+    venue, artist = add_venue(), add_artist()
+    now = rolled_over_at()
+    upcoming = add_show(venue, artist, now + timedelta(days=1))
+    past = add_show(venue, artist, now - timedelta(days=1))
+    fyyur.db.session.delete(upcoming)
+    fyyur.db.session.commit()
+    assert counts(fyyur.Venue, venue.id) == (0, 1)
+    fyyur.db.session.delete(past)
+    fyyur.db.session.commit()
+    assert counts(fyyur.Venue, venue.id) == (0, 0)
+    assert counts(fyyur.Artist, artist.id) == (0, 0)
+
+
+def test_adjust_show_counts_accepts_string_start_times(app):
+    venue, artist = add_venue(), add_artist()
+    connection = fyyur.db.session.connection()
+    later = (rolled_over_at() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    fyyur.adjust_show_counts(connection, [(str(venue.id), str(artist.id), later)] * 2)
+    fyyur.adjust_show_counts(connection, [(venue.id, artist.id, later)], -1)
+    assert counts(fyyur.Venue, venue.id) == (1, 0)
+    assert counts(fyyur.Artist, artist.id) == (1, 0)
+
+
+def test_rollover_moves_started_shows_to_past(app):
+    venue, artist = add_venue(), add_artist()
+    other = add_venue('Park Square Live Music & Coffee')
+    now = rolled_over_at()
+    add_show(venue, artist, now + timedelta(hours=1))
+    add_show(other, artist, now + timedelta(hours=2))
+    add_show(venue, artist, now + timedelta(days=3))
+    connection = fyyur.db.session.connection()
+    assert fyyur.roll_over_show_counts(connection, now + timedelta(days=1)) == 2
+    assert counts(fyyur.Venue, venue.id) == (1, 1)
+    assert counts(fyyur.Venue, other.id) == (0, 1)
+    assert counts(fyyur.Artist, artist.id) == (1, 2)
+    assert rolled_over_at() == now + timedelta(days=1)
+    # rolling over to an earlier time changes nothing
+    assert fyyur.roll_over_show_counts(connection, now) == 0
+    assert rolled_over_at() == now + timedelta(days=1)
+    assert list(fyyur.stale_show_counts(connection)) == []
+
+
+def test_stale_show_counts_finds_and_fixes_wrong_counters(app):
+    venue, artist = add_venue(), add_artist()
+    add_show(venue, artist, rolled_over_at() + timedelta(days=1))
+    connection = fyyur.db.session.connection()
+    assert list(fyyur.stale_show_counts(connection)) == []
+    connection.execute(fyyur.Venue.__table__.update().values(upcoming_shows_count=5))
+    assert list(fyyur.stale_show_counts(connection, fix=True)) == [(fyyur.Venue, venue.id, (5, 0), (1, 0))]
+    assert list(fyyur.stale_show_counts(connection)) == []
+    assert counts(fyyur.Venue, venue.id) == (1, 0)
@@ -0,0 +1,189 @@
+import io
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import app as fyyur
+import thumbnails
+from thumbnails import ImageFetchError, fetch_image
+from tests.factories import add_artist, add_show, add_venue
+
+IMAGE_LINK = 'https://images.example.com/artist.jpg'
+OTHER_LINK = 'https://images.example.com/venue.jpg'
+
+
+def image(color):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def fetch(app, monkeypatch):
+    '''Fetch a URL into the thumbnail cache, downloading a plain image of `color` instead.'''
+    cache = app.extensions['thumbnails']
+
+    def fetch(url, color='red'):
+        monkeypatch.setattr(thumbnails, 'fetch_image', lambda *args: image(color))
+        return cache.fetch(url)
+    return fetch
+
+
+def add_show_with_image():
+    venue, artist = add_venue(), add_artist()
+    # set behind the ORM's back, so no background fetch starts
+    fyyur.db.session.execute(fyyur.Artist.__table__.update().values(image_link=IMAGE_LINK))
+    fyyur.db.session.commit()
+    add_show(venue, artist, datetime.now() + timedelta(days=1))
+    return venue, artist
+
+
+def etags(client, paths):
+    return dict((path, client.get(path).headers['ETag']) for path in paths)
+
+
+def test_thumbnails_change_the_validators_of_the_pages_showing_them(app, client, fetch):
+    venue, artist = add_show_with_image()
+    paths = ['/shows', '/venues/%d' % venue.id, '/artists/%d' % artist.id]
+    before = etags(client, paths)
+
+    # no page shows this image
+    fetch(OTHER_LINK)
+    assert etags(client, paths) == before
+
+    fetch(IMAGE_LINK)
+    after = etags(client, paths)
+    for path in paths:
+        assert after[path] != before[path], path
+
+
+def test_show_tiles_link_new_thumbnails(app, client, fetch):
+    add_show_with_image()
+    assert b'<picture>' not in client.get('/shows').data
+    fetch(IMAGE_LINK)
+    assert b'<picture>' in client.get('/shows').data
+
+
+def test_eviction_removes_the_least_recently_used_images(app, client, fetch, monkeypatch):
+    add_show_with_image()
+    cache = app.extensions['thumbnails']
+    evicted = fetch(IMAGE_LINK, 'red')
+    kept = fetch(OTHER_LINK, 'blue')
+    # the first image was last used an hour ago
+    for name in os.listdir(os.path.join(cache.directory, evicted[:2])):
+        if name.startswith(evicted):
+            os.utime(os.path.join(cache.directory, evicted[:2], name), (time.time() - 3600,) * 2)
+    tiles = client.get('/shows')
+    assert b'<picture>' in tiles.data
+
+    kept_bytes = sum(os.path.getsize(os.path.join(cache.directory, kept[:2], name))
+                     for name in os.listdir(os.path.join(cache.directory, kept[:2])) if name.startswith(kept))
+    # eviction trims to 90% of the limit: room for the kept image only
+    cache.max_bytes = int(kept_bytes / 0.9) + 1
+    assert cache.evict() == 1
+    assert cache.state(IMAGE_LINK) is None
+    assert cache.state(OTHER_LINK) is not None
+    assert not [name for name in os.listdir(os.path.join(cache.directory, evicted[:2])) if name.startswith(evicted)]
+
+    # pages stop linking it, and rendering them fetches nothing
+    monkeypatch.setattr(cache, 'submit', lambda url: pytest.fail('fetched %s' % url))
+    response = client.get('/shows', headers={'If-None-Match': tiles.headers['ETag']})
+    assert response.status_code == 200
+    assert b'<picture>' not in response.data
+
+
+def test_thumbnail_links_are_not_served(app, client, fetch):
+    digest = fetch(IMAGE_LINK)
+    link = os.path.basename(app.extensions['thumbnails'].link_path(IMAGE_LINK))
+    for filename in ('links/' + link, 'links/../links/' + link, './links/' + link, './/links/' + link,
+                     '%s/%s.links' % (digest[:2], digest)):
+        assert client.get('/thumbnails/' + filename).status_code == 404, filename
+    assert client.get('/thumbnails/' + app.extensions['thumbnails'].filename(digest, 'tile', 'jpg')).status_code == 200
+
+
+@pytest.fixture
+def image_server(monkeypatch):
+    '''A local server answered for images.example.com, with the Host headers it received.'''
+    hosts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hosts.append(self.headers['Host'])
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b'image')
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    # images.example.com resolves to the addresses listed here, in turn,
+    # the last one for every later lookup; 127.0.0.1 by default
+    answers = []
+    getaddrinfo = socket.getaddrinfo
+
+    def fake_getaddrinfo(host, port, *args, **kwargs):
+        if host != 'images.example.com':
+            return getaddrinfo(host, port, *args, **kwargs)
+        address = answers.pop(0) if len(answers) > 1 else (answers or ['127.0.0.1'])[0]
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, port))]
+    monkeypatch.setattr(thumbnails.socket, 'getaddrinfo', fake_getaddrinfo)
+    yield 'http://images.example.com:%d/image.jpg' % server.server_port, hosts, answers
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_refuses_private_addresses(image_server):
+    url, hosts, _ = image_server
+    with pytest.raises(ImageFetchError):
+        fetch_image(url, timeout=5)
+    assert hosts == []
+
+
+def test_fetch_connects_to_the_address_it_checked(image_server, monkeypatch):
+    url, hosts, answers = image_server
+    # a rebinding DNS server: public for the check, private for the connection
+    answers.extend(['93.184.216.34', '127.0.0.1'])
+    connected = []
+    connect = socket.socket.connect
+
+    def fake_connect(sock, address):
+        connected.append(address[0])
+        if address[0] != '127.0.0.1':
+            raise ConnectionRefusedError('not reachable from the tests')
+        return connect(sock, address)
+    monkeypatch.setattr(socket.socket, 'connect', fake_connect)
+    with pytest.raises(ImageFetchError):
+        fetch_image(url, timeout=5)
+    assert connected == ['93.184.216.34']
+    assert hosts == []
+
+
+def test_fetch_sends_the_original_host(image_server):
+    url, hosts, _ = image_server
+    assert fetch_image(url, timeout=5, allow_private=True) == b'image'
+    assert hosts == [url.split('/')[2]]
+
+
+def test_images_are_fetched_once_committed(app, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(app.extensions['thumbnails'], 'submit', submitted.append)
+    venue = add_venue()
+    venue.image_link = OTHER_LINK
+    fyyur.db.session.flush()
+    assert submitted == []
+    fyyur.db.session.rollback()
+    assert submitted == []
+
+    venue = fyyur.Venue.query.get(venue.id)
+    venue.image_link = IMAGE_LINK
+    fyyur.db.session.commit()
+    assert submitted == [IMAGE_LINK]
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from tests.factories import add_artist, add_show, add_venue
+
+
+def backdate(*models):
+    # an hour back, so a change within the test moves the second-granular Last-Modified
+    then = datetime.now() - timedelta(hours=1)
+    for model in models:
+        table = model.__table__
+        values = {'created_at': then} if model is fyyur.Show else {'updated_at': then}
+        fyyur.db.session.execute(table.update().values(values))
+    fyyur.db.session.commit()
+
+
+@pytest.mark.parametrize('page', ['/venues/%(venue)d', '/artists/%(artist)d'])
+def test_deleting_a_show_moves_last_modified(app, client, page):
+    venue, artist = add_venue(), add_artist()
+    show = add_show(venue, artist, datetime.now() + timedelta(days=1))
+    path = page % {'venue': venue.id, 'artist': artist.id}
+    backdate(fyyur.Venue, fyyur.Artist, fyyur.Show)
+    before = client.get(path)
+    assert before.status_code == 200
+
+    fyyur.db.session.delete(fyyur.Show.query.get(show.id))
+    fyyur.db.session.commit()
+    after = client.get(path, headers={'If-Modified-Since': before.headers['Last-Modified']})
+    assert after.status_code == 200
+    assert after.last_modified > before.last_modified
+    assert after.headers['ETag'] != before.headers['ETag']
+
+
+def test_detail_body_matches_its_etag(app, client):
+    venue = add_venue()
+    first = client.get('/venues/%d' % venue.id)
+    assert b'The Musical Hop' in first.data
+
+    # edited by another worker: this one's cached entry is not invalidated
+    table = fyyur.Venue.__table__
+    fyyur.db.session.execute(table.update().values(name='The Musical Hop Annex', version=table.c.version + 1))
+    fyyur.db.session.commit()
+    second = client.get('/venues/%d' % venue.id)
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert b'The Musical Hop Annex' in second.data
+
+
+@pytest.mark.parametrize('page', ['/venues/%(venue)d', '/artists/%(artist)d'])
+def test_counter_rollover_keeps_the_validators(app, client, page):
+    venue, artist = add_venue(), add_artist()
+    start_time = datetime.now() + timedelta(days=1)
+    add_show(venue, artist, start_time)
+    path = page % {'venue': venue.id, 'artist': artist.id}
+    backdate(fyyur.Venue, fyyur.Artist, fyyur.Show)
+    before = client.get(path)
+
+    # the show counts as past from here on, but has not started for the page yet
+    assert fyyur.roll_over_show_counts(fyyur.db.session.connection(), start_time + timedelta(hours=1)) == 1
+    fyyur.db.session.commit()
+    after = client.get(path, headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 304
+    assert client.get(path).last_modified == before.last_modified
@@ -0,0 +1,396 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from flask import abort, current_app, send_from_directory, url_for
+from markupsafe import Markup
+from werkzeug.utils import safe_join
+
+#----------------------------------------------------------------------------#
+# Image thumbnails.
+#
+# Each image_link is downloaded once, on a background thread, and cut into
+# fixed-size WebP and JPEG thumbnails. Thumbnails are named after the hash
+# of the original image, so identical images share them and a file name
+# never changes meaning, which lets /thumbnails/ serve them as immutable.
+# The cache directory is kept under its size limit by evicting the files
+# least recently written or served, an image at a time, together with the
+# links to it. A page's validators and cached fragments include the times
+# of the links of the images it shows, which change whenever their
+# thumbnails appear or go.
+#----------------------------------------------------------------------------#
+
+# (file extension, Pillow format, save options), in <picture> preference order
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+
+log = logging.getLogger(__name__)
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+def check_url(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageFetchError('Not an http(s) URL: %r' % url)
+
+
+def public_addresses(host, port, allow_private):
+    '''Return the socket addresses of `host`, all of which must be public.'''
+    try:
+        addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as error:
+        raise ImageFetchError('Cannot resolve %s: %s' % (host, error))
+    # the server must not be tricked into fetching from its own network
+    if not allow_private:
+        for address in addresses:
+            if not ipaddress.ip_address(address[4][0].split('%')[0]).is_global:
+                raise ImageFetchError('%s resolves to a non-public address' % host)
+    return addresses
+
+
+def checked_connection(connection_class, allow_private):
+    '''Return a `connection_class` factory whose connections only reach checked addresses.
+
+    The host is resolved once, checked, and connected to by address, so a
+    DNS answer that changes after the check cannot redirect the fetch. TLS
+    still verifies the certificate against the host name.
+    '''
+    def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        error = None
+        for family, type, proto, _, sockaddr in public_addresses(address[0], address[1], allow_private):
+            sock = socket.socket(family, type, proto)
+            try:
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as connect_error:
+                error = connect_error
+                sock.close()
+        raise error
+
+    def connection(host, **kwargs):
+        conn = connection_class(host, **kwargs)
+        conn._create_connection = create_connection
+        return conn
+    return connection
+
+
+class CheckedHTTPHandler(urllib.request.HTTPHandler):
+
+    def __init__(self, allow_private):
+        urllib.request.HTTPHandler.__init__(self)
+        self.allow_private = allow_private
+
+    def http_open(self, req):
+        return self.do_open(checked_connection(http.client.HTTPConnection, self.allow_private), req)
+
+
+class CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+
+    def __init__(self, allow_private):
+        urllib.request.HTTPSHandler.__init__(self)
+        self.allow_private = allow_private
+
+    def https_open(self, req):
+        return self.do_open(checked_connection(http.client.HTTPSConnection, self.allow_private), req)
+
+
+class CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl)
+        return urllib.request.HTTPRedirectHandler.redirect_request(self, req, fp, code, msg, headers, newurl)
+
+
+def fetch_image(url, timeout=10, max_bytes=20 * 1024 * 1024, allow_private=False):
+    '''Return the body of the image at `url`, at most `max_bytes` long.'''
+    check_url(url)
+    # no proxy: the checked address must be the one connected to
+    opener = urllib.request.build_opener(
+        urllib.request.ProxyHandler({}), CheckedHTTPHandler(allow_private), CheckedHTTPSHandler(allow_private),
+        CheckedRedirectHandler())
+    request = urllib.request.Request(url, headers={'User-Agent': 'fyyur-thumbnailer'})
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            data = response.read(max_bytes + 1)
+    except (OSError, ValueError) as error:
+        raise ImageFetchError('Cannot fetch %s: %s' % (url, error))
+    if len(data) > max_bytes:
+        raise ImageFetchError('%s is larger than %d bytes' % (url, max_bytes))
+    return data
+
+
+def make_thumbnails(data, sizes):
+    '''Yield (size name, extension, encoded thumbnail) for the image `data`.'''
+    from PIL import Image, ImageOps
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise ImageFetchError('Not a usable image: %s' % error)
+    for name, size in sorted(sizes.items()):
+        thumbnail = ImageOps.fit(image, tuple(size), Image.LANCZOS)
+        for extension, format, options in FORMATS:
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, format, **options)
+            yield name, extension, buffer.getvalue()
+
+
+def write_file(path, data):
+    # written aside and renamed, so a reader never sees half a file
+    partial = '%s.%d.%d' % (path, os.getpid(), threading.get_ident())
+    with open(partial, 'wb') as output:
+        output.write(data)
+    os.replace(partial, path)
+
+
+class ThumbnailCache(object):
+    '''Content-addressed thumbnails of remote images in `directory`.
+
+    links/<sha1 of URL> holds the sha256 of the image the URL returned;
+    <digest[:2]>/<digest>-<size>.<extension> are its thumbnails and
+    <digest[:2]>/<digest>.links lists the links to it, one per line.
+    '''
+
+    def __init__(self, directory, sizes, max_bytes, workers=2, timeout=10,
+                 max_source_bytes=20 * 1024 * 1024, allow_private=False):
+        self.directory = directory
+        self.sizes = sizes
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.timeout = timeout
+        self.max_source_bytes = max_source_bytes
+        self.allow_private = allow_private
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._pid = None
+        self._executor = None
+
+    def link_path(self, url):
+        return os.path.join(self.directory, 'links', hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def filename(self, digest, size, extension):
+        return '%s/%s-%s.%s' % (digest[:2], digest, size, extension)
+
+    def links_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + '.links')
+
+    def has(self, url):
+        return os.path.exists(self.link_path(url))
+
+    def state(self, url):
+        '''Return a value that changes whenever the thumbnails of `url` appear, change or go.'''
+        try:
+            return os.stat(self.link_path(url)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def lookup(self, url, size):
+        '''Return {extension: filename} of the thumbnails of `url`, or None.'''
+        try:
+            with open(self.link_path(url)) as link_file:
+                digest = link_file.read().strip()
+        except FileNotFoundError:
+            return None
+        filenames = dict((extension, self.filename(digest, size, extension)) for extension, _, _ in FORMATS)
+        if not all(os.path.exists(os.path.join(self.directory, name)) for name in filenames.values()):
+            # being evicted; `flask thumbnails fetch` fetches it again
+            return None
+        return filenames
+
+    def fetch(self, url):
+        '''Download `url` and store its thumbnails; return the image's digest.'''
+        data = fetch_image(url, self.timeout, self.max_source_bytes, self.allow_private)
+        digest = hashlib.sha256(data).hexdigest()
+        os.makedirs(os.path.join(self.directory, digest[:2]), exist_ok=True)
+        for size, extension, thumbnail in make_thumbnails(data, self.sizes):
+            write_file(os.path.join(self.directory, self.filename(digest, size, extension)), thumbnail)
+        with open(self.links_path(digest), 'a') as links_file:
+            links_file.write(os.path.basename(self.link_path(url)) + '\n')
+        # the link last, so a linked image always has all its thumbnails
+        os.makedirs(os.path.join(self.directory, 'links'), exist_ok=True)
+        write_file(self.link_path(url), digest.encode('ascii'))
+        return digest
+
+    def executor(self):
+        # threads do not survive a fork, so each worker process starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers)
+                    self._pending = set()
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, url):
+        '''Fetch `url` in the background, unless it is already being fetched.'''
+        executor = self.executor()
+        with self._lock:
+            if url in self._pending:
+                return None
+            self._pending.add(url)
+        return executor.submit(self._fetch_in_background, url)
+
+    def _fetch_in_background(self, url):
+        try:
+            return self.fetch(url)
+        except ImageFetchError as error:
+            log.warning('No thumbnails for %s: %s', url, error)
+        except Exception:
+            log.exception('Thumbnailing %s failed', url)
+        finally:
+            with self._lock:
+                self._pending.discard(url)
+
+    def evict(self):
+        '''Delete the least recently used images beyond max_bytes; return how many.'''
+        # {digest: [last used, bytes, paths]}
+        images, total = {}, 0
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir() or prefix.name == 'links':
+                continue
+            for entry in os.scandir(prefix.path):
+                stat = entry.stat()
+                image = images.setdefault(entry.name.split('-')[0].split('.')[0], [0, 0, []])
+                image[0] = max(image[0], stat.st_mtime)
+                image[1] += stat.st_size
+                image[2].append(entry.path)
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        # evict down to 90% of the limit, so every run does not evict
+        for digest, (_, size, paths) in sorted(images.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes * 0.9:
+                break
+            # unlinked first, so pages stop linking the thumbnails before they go
+            self.unlink(digest)
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            evicted += 1
+        return evicted
+
+    def unlink(self, digest):
+        try:
+            with open(self.links_path(digest)) as links_file:
+                names = set(links_file.read().split())
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, 'links', name)
+            try:
+                with open(path) as link_file:
+                    # a URL relinked to another image since keeps its link
+                    if link_file.read().strip() == digest:
+                        os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def touch(self, filename):
+        try:
+            os.utime(os.path.join(self.directory, filename))
+        except OSError:
+            pass
+
+
+class Thumbnails(object):
+    '''Serve the thumbnail cache and link thumbnails from templates.'''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('THUMBNAIL_DIR', None)
+        app.config.setdefault('THUMBNAIL_SIZES', {'tile': (400, 400), 'detail': (1000, 750)})
+        app.config.setdefault('THUMBNAIL_CACHE_MAX_BYTES', 1024 * 1024 * 1024)
+        app.config.setdefault('THUMBNAIL_WORKERS', 2)
+        app.config.setdefault('THUMBNAIL_FETCH_TIMEOUT', 10)
+        app.config.setdefault('THUMBNAIL_MAX_SOURCE_BYTES', 20 * 1024 * 1024)
+        app.config.setdefault('THUMBNAIL_ALLOW_PRIVATE', False)
+        app.config.setdefault('THUMBNAIL_MAX_AGE', 365 * 24 * 3600)
+        directory = app.config['THUMBNAIL_DIR'] or os.path.join(app.instance_path, 'thumbnails')
+        os.makedirs(directory, exist_ok=True)
+        app.extensions['thumbnails'] = ThumbnailCache(
+            directory,
+            app.config['THUMBNAIL_SIZES'],
+            app.config['THUMBNAIL_CACHE_MAX_BYTES'],
+            app.config['THUMBNAIL_WORKERS'],
+            app.config['THUMBNAIL_FETCH_TIMEOUT'],
+            app.config['THUMBNAIL_MAX_SOURCE_BYTES'],
+            app.config['THUMBNAIL_ALLOW_PRIVATE'])
+        app.add_url_rule('/thumbnails/<path:filename>', 'thumbnail', self.send_thumbnail)
+        app.jinja_env.globals['thumbnail'] = self.urls
+        app.jinja_env.globals['render_image'] = self.render_image
+        app.jinja_env.globals['render_images'] = self.render_images
+
+    def states(self, image_links):
+        '''Map each of `image_links` to the state of its thumbnails, for the
+        validators and cache keys of a rendering that links them.'''
+        cache = current_app.extensions['thumbnails']
+        return dict((image_link, cache.state(image_link)) for image_link in set(image_links) if image_link)
+
+    def urls(self, image_link, size):
+        '''Return {extension: URL} of the thumbnails of `image_link`, or None.'''
+        if not image_link:
+            return None
+        filenames = current_app.extensions['thumbnails'].lookup(image_link, size)
+        if filenames is None:
+            return None
+        return dict((extension, url_for('thumbnail', filename=filename))
+                    for extension, filename in filenames.items())
+
+    def render_image(self, image_link, size, alt):
+        '''Return a <picture> of the thumbnails of `image_link`, or an <img> of the original.'''
+        thumbs = self.urls(image_link, size)
+        if thumbs is None:
+            return Markup('<img src="%s" alt="%s" />') % (image_link or '', alt)
+        return Markup('<picture><source type="image/webp" srcset="%s" /><img src="%s" alt="%s" /></picture>') % (
+            thumbs['webp'], thumbs['jpg'], alt)
+
+    def render_images(self, records, key, size, alt):
+        '''Map each distinct `key` image link of `records` to its render_image() tag.
+
+        A detail page can list thousands of shows, mostly sharing a few
+        images; a lookup in this map costs much less than a call from the
+        template for each show.
+        '''
+        return dict((image_link, self.render_image(image_link, size, alt))
+                    for image_link in set(record[key] for record in records))
+
+    def send_thumbnail(self, filename):
+        cache = current_app.extensions['thumbnails']
+        max_age = current_app.config['THUMBNAIL_MAX_AGE']
+        # checked as send_from_directory will resolve it, not as spelled
+        path = safe_join(cache.directory, filename)
+        if path is None:
+            abort(404)
+        filename = os.path.relpath(path, cache.directory)
+        if filename.split(os.sep)[0] == 'links' or filename.endswith('.links'):
+            abort(404)
+        # served through wsgi.file_wrapper (sendfile under gunicorn), or by
+        # the front-end server with USE_X_SENDFILE
+        response = send_from_directory(cache.directory, filename, max_age=max_age)
+        cache.touch(filename)
+        # the name is the hash of the original, so a cached copy never goes stale
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % max_age
+        return response